@@ -0,0 +1,273 @@
+"""
+Benchmarks for the plugin's Python hot paths.
+
+They run outside of Sublime Text, using the stand-ins for the `sublime`, `sublime_plugin` and `LSP` modules in
+`benchmarks/stubs`. Each benchmark reports the best wall time over a number of repeats and the peak memory
+allocated by a separate, traced run.
+
+    python benchmarks/run.py                    # run everything and compare with benchmarks/baseline.json
+    python benchmarks/run.py parse_syntax_tree  # only run benchmarks whose name contains the given text
+    python benchmarks/run.py --save-baseline    # record the results as the new baseline
+    python benchmarks/run.py --check            # exit with status 1 when a benchmark regressed
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Iterator
+import argparse
+import atexit
+import gc
+import gzip
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+PACKAGE_DIR = BENCHMARKS_DIR.parent
+BASELINE_FILE = BENCHMARKS_DIR / 'baseline.json'
+
+REGRESSION_THRESHOLD = 1.25
+"""A benchmark regressed when its time or peak memory exceeds the baseline by this factor."""
+
+Setup = Callable[[], Callable[[], Any]]
+"""Prepares the fixture of a benchmark and returns the function to measure."""
+
+
+def load_package() -> types.ModuleType:
+    sys.path.insert(0, str(BENCHMARKS_DIR / 'stubs'))
+    try:
+        import typing_extensions  # noqa: F401
+    except ImportError:
+        fallback = types.ModuleType('typing_extensions')
+        fallback.override = lambda f: f  # type: ignore
+        fallback.NotRequired = Any  # type: ignore
+        sys.modules['typing_extensions'] = fallback
+    # The package directory name isn't a valid identifier, so register it under another name.
+    package = types.ModuleType('LSP_rust_analyzer')
+    package.__path__ = [str(PACKAGE_DIR)]  # type: ignore
+    sys.modules['LSP_rust_analyzer'] = package
+    return package
+
+
+load_package()
+
+from LSP_rust_analyzer import command_syntax_tree  # noqa: E402
+from LSP_rust_analyzer import plugin  # noqa: E402
+from LSP_rust_analyzer import plugin_commands  # noqa: E402
+from LSP_rust_analyzer import server_installer  # noqa: E402
+import sublime  # noqa: E402
+
+KINDS = ['FN', 'BLOCK_EXPR', 'STMT_LIST', 'LET_STMT', 'CALL_EXPR', 'PATH_EXPR', 'ARG_LIST']
+TOKEN_KINDS = ['IDENT', 'WHITESPACE', 'L_PAREN', 'R_PAREN', 'SEMICOLON', 'INT_NUMBER']
+
+
+def syntax_tree_json(size: int, seed: int = 0) -> str:
+    """Return a `rust-analyzer/viewSyntaxTree` response with about `size` elements."""
+    rng = random.Random(seed)
+    offset = 0
+    count = 0
+
+    def position(offset: int) -> list[int]:
+        return [offset, offset // 40, offset % 40]
+
+    def element(depth: int) -> dict[str, Any]:
+        nonlocal offset, count
+        count += 1
+        start = offset
+        if depth > 8 or count >= size or rng.random() < 0.45:
+            offset += rng.randint(1, 8)
+            return {'type': 'Token', 'kind': rng.choice(TOKEN_KINDS), 'start': position(start), 'end': position(offset)}
+        children = [element(depth + 1) for _ in range(rng.randint(1, 5))]
+        return {
+            'type': 'Node', 'kind': rng.choice(KINDS), 'start': position(start), 'end': position(offset),
+            'children': children,
+        }
+
+    children = []
+    while count < size:
+        children.append(element(0))
+    root = {'type': 'Node', 'kind': 'SOURCE_FILE', 'start': position(0), 'end': position(offset), 'children': children}
+    return json.dumps(root)
+
+
+def text_edits(count: int, *, snippets: bool) -> list[dict[str, Any]]:
+    edits: list[dict[str, Any]] = []
+    for i in range(count):
+        edit: dict[str, Any] = {
+            'range': {'start': {'line': i, 'character': 0}, 'end': {'line': i, 'character': 10}},
+            'newText': f'let value_{i} = compute(${{0}});' if snippets and i % 10 == 0 else f'let value_{i} = 0;',
+        }
+        if snippets and i % 10 == 0:
+            edit['insertTextFormat'] = 2
+        edits.append(edit)
+    return edits
+
+
+def code_action_resolve_response(files: int, edits_per_file: int, *, snippets: bool) -> dict[str, Any]:
+    return {
+        'method': 'codeAction/resolve',
+        'result': {
+            'title': 'Rename',
+            'edit': {
+                'documentChanges': [
+                    {
+                        'textDocument': {'uri': f'file:///src/module_{i}.rs', 'version': 1},
+                        'edits': text_edits(edits_per_file, snippets=snippets),
+                    }
+                    for i in range(files)
+                ],
+            },
+        },
+    }
+
+
+def bench_parse_syntax_tree(size: int) -> Setup:
+    def setup() -> Callable[[], Any]:
+        payload = syntax_tree_json(size)
+        return lambda: command_syntax_tree.parseSyntaxTree(payload)
+    return setup
+
+
+def bench_get_tree_item(size: int) -> Setup:
+    def setup() -> Callable[[], Any]:
+        root = command_syntax_tree.parseSyntaxTree(syntax_tree_json(size))
+        provider = command_syntax_tree.SyntaxTreeProvider([root], view_id=1)
+
+        def run() -> None:
+            # Expand every element, like a user would do one level at a time.
+            pending = [root]
+            while pending:
+                element = pending.pop()
+                provider.get_tree_item(element)
+                pending.extend(element.children)
+        return run
+    return setup
+
+
+def bench_code_action_resolve(files: int, edits_per_file: int, *, snippets: bool) -> Setup:
+    def setup() -> Callable[[], Any]:
+        rust_analyzer = plugin.RustAnalyzer.__new__(plugin.RustAnalyzer)
+        response = code_action_resolve_response(files, edits_per_file, snippets=snippets)
+        # Converting the snippets is idempotent, so the same response can be processed repeatedly.
+        return lambda: rust_analyzer.on_server_response_async(response)  # type: ignore
+    return setup
+
+
+def bench_move_item(edits: int) -> Setup:
+    def setup() -> Callable[[], Any]:
+        command = plugin_commands.RustAnalyzerMoveItemCommand(sublime.View())
+        payload = text_edits(edits, snippets=True)
+        # The response belongs to the latest move of the view, which is what gets applied.
+        queue = plugin_commands._move_queues[command.view.id()] = plugin_commands.MoveQueue()
+        # The edits are replaced in the list, so each run gets a fresh (shallow) copy.
+        return lambda: command.on_result_async([dict(edit) for edit in payload], 0, queue, 0)  # type: ignore
+    return setup
+
+
+def bench_install_server(size_mib: int) -> Setup:
+    def setup() -> Callable[[], Any]:
+        fixture_dir = Path(tempfile.mkdtemp(prefix='lsp-rust-analyzer-bench-'))
+        atexit.register(shutil.rmtree, fixture_dir, True)
+        archive_name = f'rust-analyzer-{plugin.arch()}-{plugin.platform()}.gz'
+        mirror = fixture_dir / 'mirror' / plugin.TAG / archive_name
+        mirror.parent.mkdir(parents=True)
+        with gzip.open(mirror, 'wb', compresslevel=1) as f:
+            chunk = os.urandom(1 << 20)
+            for _ in range(size_mib):
+                f.write(chunk)
+        # Mirrors have to publish the checksum next to each archive.
+        server_installer.checksum_path(mirror).write_text(f'{server_installer.sha256_of(mirror)}  {archive_name}\n', encoding='utf-8')
+
+        class RustAnalyzer(plugin.RustAnalyzer):
+            plugin_storage_path = fixture_dir / 'storage'
+
+        options: plugin.InstallOptions = {
+            'background_update': False,
+            'download_url': str(fixture_dir / 'mirror'),
+            'cache_dir': None,
+        }
+
+        def run() -> None:
+            if RustAnalyzer.plugin_storage_path.is_dir():
+                for path in RustAnalyzer.plugin_storage_path.iterdir():
+                    shutil.rmtree(path, ignore_errors=True)
+            RustAnalyzer.install_server(options)
+        return run
+    return setup
+
+
+BENCHMARKS: dict[str, tuple[Setup, int]] = {
+    # name: (setup, repeats)
+    'parse_syntax_tree[1k]': (bench_parse_syntax_tree(1_000), 20),
+    'parse_syntax_tree[10k]': (bench_parse_syntax_tree(10_000), 10),
+    'parse_syntax_tree[100k]': (bench_parse_syntax_tree(100_000), 3),
+    'parse_syntax_tree[1M]': (bench_parse_syntax_tree(1_000_000), 1),
+    'get_tree_item[100k]': (bench_get_tree_item(100_000), 3),
+    'code_action_resolve[plain, 2000x50]': (bench_code_action_resolve(2000, 50, snippets=False), 3),
+    'code_action_resolve[snippets, 2000x50]': (bench_code_action_resolve(2000, 50, snippets=True), 3),
+    'move_item[10k]': (bench_move_item(10_000), 5),
+    'install_server[32 MiB]': (bench_install_server(32), 3),
+}
+
+
+def measure(setup: Setup, repeats: int) -> dict[str, float]:
+    run = setup()
+    best = float('inf')
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': best, 'peak_mib': peak / (1 << 20)}
+
+
+def compare(result: dict[str, float], baseline: dict[str, float] | None) -> Iterator[str]:
+    if baseline is None:
+        yield 'new'
+        return
+    for key in ('seconds', 'peak_mib'):
+        if baseline[key] > 0:
+            ratio = result[key] / baseline[key]
+            marker = ' REGRESSION' if ratio > REGRESSION_THRESHOLD else ''
+            yield f'{key} x{ratio:.2f}{marker}'
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the plugin outside of Sublime Text.')
+    parser.add_argument('filter', nargs='?', default='', help='only run benchmarks whose name contains this text')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results in baseline.json')
+    parser.add_argument('--check', action='store_true', help='exit with status 1 if a benchmark regressed')
+    args = parser.parse_args()
+    baseline: dict[str, dict[str, float]] = {}
+    if BASELINE_FILE.is_file():
+        baseline = json.loads(BASELINE_FILE.read_text(encoding='utf-8'))
+    results: dict[str, dict[str, float]] = {}
+    regressed = False
+    for name, (setup, repeats) in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        result = results[name] = measure(setup, repeats)
+        comparison = ', '.join(compare(result, baseline.get(name)))
+        regressed = regressed or 'REGRESSION' in comparison
+        print(f'{name:<42} {result["seconds"] * 1000:>10.2f} ms {result["peak_mib"]:>9.2f} MiB   {comparison}')
+    if args.save_baseline:
+        baseline.update(results)
+        BASELINE_FILE.write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n', encoding='utf-8')
+    return 1 if args.check and regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""Minimal stand-in for the `LSP.plugin` API. Only the names imported by the plugin are provided."""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Generic
+from typing import TypeVar
+import sublime
+import sublime_plugin
+import tempfile
+
+T = TypeVar('T')
+F = TypeVar('F', bound=Callable[..., Any])
+
+ClientRequest = Dict[str, Any]
+ServerNotification = Dict[str, Any]
+ServerResponse = Dict[str, Any]
+
+
+class Promise(Generic[T]):
+
+    def __init__(self, value: T) -> None:
+        self.value = value
+
+    @staticmethod
+    def resolve(value: T) -> Promise[T]:
+        return Promise(value)
+
+    def then(self, callback: Callable[[T], Any]) -> Promise[Any]:
+        return Promise(callback(self.value))
+
+
+class Request(Generic[T]):
+
+    def __init__(self, method: str, params: Any = None) -> None:
+        self.method = method
+        self.params = params
+
+
+class Notification:
+
+    def __init__(self, method: str, params: Any = None) -> None:
+        self.method = method
+        self.params = params
+
+
+class DottedDict:
+
+    def __init__(self, d: dict[str, Any] | None = None) -> None:
+        self._d = dict(d or {})
+
+    def get(self, key: str | None = None, default: Any = None) -> Any:
+        return dict(self._d) if key is None else self._d.get(key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        self._d[key] = value
+
+    def update(self, d: dict[str, Any]) -> None:
+        self._d.update(d)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._d
+
+
+class ClientConfig:
+
+    def __init__(self, settings: dict[str, Any] | None = None, initialization_options: dict[str, Any] | None = None,
+                 root_settings: dict[str, Any] | None = None) -> None:
+        self.settings = DottedDict(settings)
+        self.initialization_options = DottedDict(initialization_options)
+        self.root_settings = DottedDict(root_settings)
+
+
+class OnPreStartContext:
+
+    def __init__(self, configuration: ClientConfig) -> None:
+        self.configuration = configuration
+        self.variables: dict[str, str] = {}
+        self.workspace_folders: list[Any] = []
+
+
+def command_handler(command: str) -> Callable[[F], F]:
+    return lambda f: f
+
+
+def notification_handler(method: str) -> Callable[[F], F]:
+    return lambda f: f
+
+
+def request_handler(method: str) -> Callable[[F], F]:
+    return lambda f: f
+
+
+def apply_text_edits(view: sublime.View, edits: Any, **kwargs: Any) -> Promise[None]:
+    return Promise(None)
+
+
+class LspPlugin:
+
+    plugin_storage_path = Path(tempfile.gettempdir()) / 'LSP-rust-analyzer-benchmarks'
+
+    def weaksession(self) -> Any:
+        return None
+
+    @classmethod
+    def register(cls) -> None:
+        pass
+
+    @classmethod
+    def unregister(cls) -> None:
+        pass
+
+
+class LspTextCommand(sublime_plugin.TextCommand):
+
+    session_name = 'rust-analyzer'
+
+    def is_enabled(self, *args: Any, **kwargs: Any) -> bool:
+        return True
+
+    def session_by_name(self, name: str | None = None, capability_path: str | None = None) -> Any:
+        return None
+
+
+class LspWindowCommand(sublime_plugin.WindowCommand):
+
+    session_name = 'rust-analyzer'
+
+    def session_by_name(self, name: str | None = None, capability_path: str | None = None) -> Any:
+        return None
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+from typing import Any
+
+
+class Error(Exception):
+
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+
+
+class Point:
+
+    def __init__(self, row: int, col: int) -> None:
+        self.row = row
+        self.col = col
+
+    @classmethod
+    def from_lsp(cls, point: Any) -> Point:
+        return Point(point['line'], point['character'])
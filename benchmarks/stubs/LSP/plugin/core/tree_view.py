@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+from enum import IntEnum
+from typing import Any
+import sublime
+
+
+class TreeItemCollapsibleState(IntEnum):
+    NONE = 1
+    COLLAPSED = 2
+    EXPANDED = 3
+
+
+class TreeItem:
+
+    def __init__(self, label: str, description: str = '', action_command: Any = None, **kwargs: Any) -> None:
+        self.label = label
+        self.description = description
+        self.action_command = action_command
+        self.collapsible_state = TreeItemCollapsibleState.COLLAPSED
+
+
+class TreeDataProvider:
+    pass
+
+
+class TreeViewSheet(sublime.Sheet):
+    pass
+
+
+def new_tree_view_sheet(window: Any, name: str, data_provider: TreeDataProvider, header: str = '', flags: int = 0,
+                        group: int = -1) -> TreeViewSheet | None:
+    return None
@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+from typing import Any
+import sublime
+
+
+def first_selection_region(view: sublime.View) -> sublime.Region | None:
+    selection = view.sel()
+    return selection[0] if len(selection) else None
+
+
+def point_to_offset(point: Any, view: sublime.View) -> int:
+    return 0
+
+
+def region_to_range(view: sublime.View, region: sublime.Region) -> dict[str, Any]:
+    return {'start': {'line': 0, 'character': region.begin()}, 'end': {'line': 0, 'character': region.end()}}
+
+
+def text_document_identifier(view: sublime.View) -> dict[str, Any]:
+    return {'uri': 'file:///benchmark.rs'}
+
+
+def text_document_position_params(view: sublime.View, location: int) -> dict[str, Any]:
+    return {'textDocument': text_document_identifier(view), 'position': {'line': 0, 'character': location}}
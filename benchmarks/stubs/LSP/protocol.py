@@ -0,0 +1,34 @@
+"""Minimal stand-in for `LSP.protocol`. Only the names imported by the plugin are provided."""
+from __future__ import annotations
+
+from enum import IntEnum
+from typing import Any
+from typing import Dict
+from typing import TypedDict
+from typing import Union
+from typing_extensions import NotRequired  # noqa: F401
+
+
+class InsertTextFormat(IntEnum):
+    PlainText = 1
+    Snippet = 2
+
+
+class TextEdit(TypedDict):
+    range: Any
+    newText: str
+
+
+LSPAny = Any
+Position = Dict[str, Any]
+Range = Dict[str, Any]
+Location = Dict[str, Any]
+LocationLink = Dict[str, Any]
+TextDocumentIdentifier = Dict[str, Any]
+TextDocumentPositionParams = Dict[str, Any]
+AnnotatedTextEdit = Dict[str, Any]
+SnippetTextEdit = Dict[str, Any]
+WorkspaceEdit = Dict[str, Any]
+LSPObject = Dict[str, Any]
+DocumentUri = str
+ProgressToken = Union[str, int]
@@ -0,0 +1,103 @@
+"""Minimal stand-in for the `sublime` module so that the plugin can be imported outside of Sublime Text."""
+from __future__ import annotations
+
+from enum import IntFlag
+from typing import Any
+from typing import Callable
+
+TRANSIENT = 4
+
+
+class NewFileFlags(IntFlag):
+    NONE = 0
+    TRANSIENT = 4
+    ADD_TO_SELECTION = 131072
+
+
+def platform() -> str:
+    return 'linux'
+
+
+def arch() -> str:
+    return 'x64'
+
+
+def status_message(message: str) -> None:
+    pass
+
+
+def error_message(message: str) -> None:
+    pass
+
+
+def set_timeout(callback: Callable[[], Any], delay: int = 0) -> None:
+    callback()
+
+
+def set_timeout_async(callback: Callable[[], Any], delay: int = 0) -> None:
+    callback()
+
+
+class Region:
+
+    def __init__(self, a: int, b: int | None = None) -> None:
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self) -> int:
+        return min(self.a, self.b)
+
+    def end(self) -> int:
+        return max(self.a, self.b)
+
+    def contains(self, x: Region | int) -> bool:
+        if isinstance(x, Region):
+            return self.begin() <= x.begin() and x.end() <= self.end()
+        return self.begin() <= x <= self.end()
+
+
+class Selection(list):
+
+    def add(self, region: Region) -> None:
+        self.append(region)
+
+
+class View:
+
+    def __init__(self, view_id: int = 1) -> None:
+        self.view_id = view_id
+        self._change_count = 0
+        self._selection = Selection([Region(0)])
+
+    def id(self) -> int:
+        return self.view_id
+
+    def is_valid(self) -> bool:
+        return True
+
+    def change_count(self) -> int:
+        return self._change_count
+
+    def sel(self) -> Selection:
+        return self._selection
+
+    def match_selector(self, point: int, selector: str) -> bool:
+        return True
+
+    def window(self) -> Window | None:
+        return None
+
+    def settings(self) -> dict[str, Any]:
+        return {}
+
+
+class Window:
+    pass
+
+
+class Sheet:
+    pass
+
+
+class Edit:
+    pass
@@ -0,0 +1,38 @@
+"""Minimal stand-in for the `sublime_plugin` module."""
+from __future__ import annotations
+
+import sublime
+
+
+class ApplicationCommand:
+    pass
+
+
+class TextCommand:
+
+    def __init__(self, view: sublime.View) -> None:
+        self.view = view
+
+
+class WindowCommand:
+
+    def __init__(self, window: sublime.Window) -> None:
+        self.window = window
+
+
+class EventListener:
+    pass
+
+
+class ViewEventListener:
+
+    def __init__(self, view: sublime.View) -> None:
+        self.view = view
+
+
+class TextInputHandler:
+    pass
+
+
+class ListInputHandler:
+    pass
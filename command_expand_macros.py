@@ -0,0 +1,311 @@
+from __future__ import annotations
+
+from .command_syntax_tree import parseSyntaxTree
+from .command_syntax_tree import SyntaxElement
+from .command_syntax_tree import SyntaxTree
+from .request_gate import send_request_when_quiescent
+from functools import partial
+from LSP.plugin import LspTextCommand
+from LSP.plugin import Request
+from LSP.plugin.core.protocol import Error
+from LSP.plugin.core.views import text_document_identifier
+from LSP.plugin.core.views import text_document_position_params
+from typing import Any
+from typing import NamedTuple
+from typing import TypedDict
+import os
+import re
+import sublime
+import sublime_plugin
+
+MAX_CONCURRENT_EXPANSIONS = 4
+"""The number of `rust-analyzer/expandMacro` requests of a batch that are in flight at the same time."""
+
+DERIVE_PATTERN = re.compile(r'#\s*\[\s*(derive)\b')
+
+# Matches the header of each expansion, so that double-clicking it jumps back to the macro call.
+HEADER_FILE_REGEX = r'^// Recursive expansion of .+ at (.+):(\d+):(\d+)$'
+
+
+class ExpandedMacro(TypedDict):
+    name: str
+    expansion: str
+
+
+class CallSite(NamedTuple):
+    point: int
+    """The point in the view of the token to expand at."""
+    region: sublime.Region
+    text: str
+    """The source the expansion depends on: the macro call, or the item of a derive attribute."""
+
+
+class FileExpansions:
+    """The expansions of the macro calls of a document, by the source text of the call site."""
+
+    def __init__(self, definitions: int) -> None:
+        # A hash of the macro definitions of the file, which all expansions of the file may depend on.
+        self.definitions = definitions
+        self.expansions: dict[str, ExpandedMacro | None] = {}
+        # The call sites found in the syntax tree of the version with this change count.
+        self.change_count = -1
+        self.call_sites: list[CallSite] = []
+
+
+_expansion_cache: dict[str, FileExpansions] = {}
+"""The cached expansions by document URI."""
+
+_batches: dict[int, ExpansionBatch] = {}
+"""The running batch by the id of the view whose macros it expands."""
+
+_output_views: dict[int, sublime.View] = {}
+"""The output view by the id of the view whose macros it shows."""
+
+
+def clear_expansion_cache(keep: str | None = None) -> None:
+    """Forget the expansions of all documents, except for those of the URI `keep`."""
+    for uri in list(_expansion_cache):
+        if uri != keep:
+            del _expansion_cache[uri]
+
+
+def element_region(view: sublime.View, element: SyntaxElement) -> sublime.Region:
+    tree, index = element.tree, element.index
+    return sublime.Region(
+        view.text_point_utf16(tree.start_lines[index], tree.start_characters[index]),
+        view.text_point_utf16(tree.end_lines[index], tree.end_characters[index]))
+
+
+def macro_definitions_hash(view: sublime.View, tree: SyntaxTree) -> int:
+    definitions = [
+        view.substr(element_region(view, element))
+        for element in tree.find_kind('MACRO_') if element.kind in ('MACRO_RULES', 'MACRO_DEF')
+    ]
+    return hash(tuple(definitions))
+
+
+def macro_call_sites(view: sublime.View, tree: SyntaxTree) -> list[CallSite]:
+    """The outermost macro calls and derive attributes of the document, in document order."""
+    call_sites: list[CallSite] = []
+    for element in tree.find_kind('MACRO_CALL') + tree.find_kind('ATTR'):
+        if element.kind == 'MACRO_CALL':
+            region = element_region(view, element)
+            # The `!` is right after the macro name, where the server looks for the call, even with attributes.
+            bang = next((child for child in element.children if child.kind == 'BANG'), None)
+            point = element_region(view, bang).a if bang else region.a
+            call_sites.append(CallSite(point, region, view.substr(region)))
+        elif element.kind == 'ATTR' and (item := element.parent) is not None:
+            region = element_region(view, element)
+            if match := DERIVE_PATTERN.match(view.substr(region)):
+                item_region = element_region(view, item)
+                call_sites.append(CallSite(region.a + match.start(1), region, view.substr(item_region)))
+    call_sites.sort(key=lambda call_site: (call_site.region.a, -call_site.region.b))
+    outermost: list[CallSite] = []
+    for call_site in call_sites:
+        # Nested calls are part of the recursive expansion of the call around them.
+        if not outermost or not outermost[-1].region.contains(call_site.region):
+            outermost.append(call_site)
+    return outermost
+
+
+def output_view(window: sublime.Window, source: sublime.View) -> sublime.View:
+    """The view that shows the expansions of the macros of `source`, emptied."""
+    view = _output_views.get(source.id())
+    if view is None or not view.is_valid():
+        view = window.new_file()
+        view.set_scratch(True)
+        view.assign_syntax('scope:source.rust')
+        settings = view.settings()
+        settings.set('result_file_regex', HEADER_FILE_REGEX)
+        settings.set('word_wrap', False)
+        _output_views[source.id()] = view
+    file_name = source.file_name()
+    view.set_name(f'Macro Expansions: {os.path.basename(file_name) if file_name else "untitled"}')
+    view.settings().set('result_base_dir', os.path.dirname(file_name) if file_name else '')
+    view.set_read_only(False)
+    view.run_command('select_all')
+    view.run_command('right_delete')
+    view.set_read_only(True)
+    return view
+
+
+class ExpansionBatch:
+    """
+    Expands a list of call sites with at most `MAX_CONCURRENT_EXPANSIONS` requests in flight, and appends the
+    expansions to the output view in document order as they come in.
+    """
+
+    def __init__(
+        self, command: RustAnalyzerExpandMacrosCommand, output: sublime.View, call_sites: list[CallSite],
+        expansions: FileExpansions, change_count: int
+    ) -> None:
+        self.command = command
+        self.view = command.view
+        self.output = output
+        self.call_sites = call_sites
+        self.expansions = expansions
+        self.change_count = change_count
+        # Set once no more requests are sent, because all were sent or the file was edited.
+        self.stopped = False
+        # Set when another batch replaced this one, or the view was closed. Nothing is written anymore then.
+        self.cancelled = False
+        self._next_request = 0
+        self._in_flight = 0
+        self._next_write = 0
+        self._sections: dict[int, str] = {}
+        self._cached = 0
+
+    def start(self) -> None:
+        self.write(f'// Expanding {len(self.call_sites)} macro calls\n\n')
+        for _ in range(MAX_CONCURRENT_EXPANSIONS):
+            self.send_next()
+        self.flush()
+
+    def send_next(self) -> None:
+        while not (self.stopped or self.cancelled) and self._next_request < len(self.call_sites):
+            if self.view.change_count() != self.change_count:
+                self.stopped = True
+                self.write('// Stopped, the file was edited. Run the command again to expand the rest.\n')
+                return
+            index = self._next_request
+            self._next_request += 1
+            call_site = self.call_sites[index]
+            if call_site.text in self.expansions.expansions:
+                self._cached += 1
+                self.add_section(index, self.expansions.expansions[call_site.text])
+                continue
+            session = self.command.session_by_name(self.command.session_name)
+            if session is None:
+                self.stopped = True
+                return
+            params = text_document_position_params(self.view, call_site.point)
+            request: Request[Any, ExpandedMacro | None] = Request('rust-analyzer/expandMacro', params)
+            self._in_flight += 1
+            session.send_request_task(request).then(partial(self.on_result_async, index))
+            return
+
+    def on_result_async(self, index: int, expanded_macro: ExpandedMacro | Error | None) -> None:
+        self._in_flight -= 1
+        if isinstance(expanded_macro, Error):
+            self._sections[index] = f'{self.header(index, "macro call")} failed: {expanded_macro}\n\n'
+        else:
+            self.expansions.expansions[self.call_sites[index].text] = expanded_macro
+            self.add_section(index, expanded_macro)
+        self.send_next()
+        self.flush()
+
+    def header(self, index: int, name: str) -> str:
+        row, col = self.view.rowcol(self.call_sites[index].point)
+        file_name = self.view.file_name()
+        location = f' at {os.path.basename(file_name)}:{row + 1}:{col + 1}' if file_name else ''
+        return f'// Recursive expansion of {name}{location}'
+
+    def add_section(self, index: int, expanded_macro: ExpandedMacro | None) -> None:
+        if expanded_macro is None:
+            self._sections[index] = f'{self.header(index, "macro call")}: nothing to expand\n\n'
+            return
+        header = self.header(index, f'{expanded_macro["name"]}! macro')
+        self._sections[index] = f'{header}\n// {(len(header) - 2) * "="}\n\n{expanded_macro["expansion"]}\n\n'
+
+    def flush(self) -> None:
+        """Write the sections that all sections before them have been written for."""
+        text = ''
+        while self._next_write in self._sections:
+            text += self._sections.pop(self._next_write)
+            self._next_write += 1
+        if self._next_write == len(self.call_sites) and not self.stopped:
+            text += f'// Expanded {len(self.call_sites)} macro calls, {self._cached} of them cached\n'
+            self.stopped = True
+        if text:
+            self.write(text)
+        if self.stopped and not self._in_flight and _batches.get(self.view.id()) is self:
+            # Nothing is written anymore, so there's nothing left to cancel either.
+            del _batches[self.view.id()]
+
+    def write(self, text: str) -> None:
+        sublime.set_timeout(partial(self._append, text))
+
+    def _append(self, text: str) -> None:
+        if not self.cancelled:
+            self.output.run_command('append', {'characters': text, 'force': True})
+
+
+class RustAnalyzerExpandMacrosCommand(LspTextCommand):
+    """Expand all macro calls of the file, or those within the selections, into one view."""
+
+    def is_enabled(self) -> bool:
+        selection = self.view.sel()
+        if len(selection) == 0:
+            return False
+        return super().is_enabled()
+
+    def run(self, _: sublime.Edit) -> None:
+        session = self.session_by_name(self.session_name)
+        if session is None:
+            return
+        uri = text_document_identifier(self.view)['uri']
+        change_count = self.view.change_count()
+        selections = [region for region in self.view.sel() if not region.empty()]
+        expansions = _expansion_cache.get(uri)
+        if expansions is not None and expansions.change_count == change_count:
+            sublime.set_timeout_async(
+                partial(self.start_batch, expansions.call_sites, expansions, selections, change_count))
+            return
+        params = text_document_position_params(self.view, self.view.sel()[0].b)
+        send_request_when_quiescent(
+            self, f"expandMacros:{self.view.id()}",
+            Request("rust-analyzer/viewSyntaxTree", params),
+            partial(self.on_syntax_tree_async, uri, change_count, selections))
+
+    def on_syntax_tree_async(self, uri: str, change_count: int, selections: list[sublime.Region], out: str) -> None:
+        if self.view.change_count() != change_count:
+            sublime.status_message('The file was edited while looking for macro calls. Run the command again.')
+            return
+        tree = parseSyntaxTree(out).tree
+        definitions = macro_definitions_hash(self.view, tree)
+        expansions = _expansion_cache.get(uri)
+        if expansions is None or expansions.definitions != definitions:
+            expansions = _expansion_cache[uri] = FileExpansions(definitions)
+        expansions.change_count = change_count
+        expansions.call_sites = macro_call_sites(self.view, tree)
+        # Only keep the expansions of the calls that are still there.
+        texts = {call_site.text for call_site in expansions.call_sites}
+        expansions.expansions = {text: value for text, value in expansions.expansions.items() if text in texts}
+        self.start_batch(expansions.call_sites, expansions, selections, change_count)
+
+    def start_batch(
+        self, call_sites: list[CallSite], expansions: FileExpansions, selections: list[sublime.Region],
+        change_count: int
+    ) -> None:
+        if selections:
+            call_sites = [
+                call_site for call_site in call_sites
+                if any(selection.intersects(call_site.region) for selection in selections)
+            ]
+        if not call_sites:
+            sublime.status_message('No macro calls to expand')
+            return
+        sublime.set_timeout(partial(self.show_batch, call_sites, expansions, change_count))
+
+    def show_batch(self, call_sites: list[CallSite], expansions: FileExpansions, change_count: int) -> None:
+        window = self.view.window()
+        if window is None:
+            return
+        if previous_batch := _batches.pop(self.view.id(), None):
+            previous_batch.cancelled = True
+        batch = _batches[self.view.id()] = ExpansionBatch(
+            self, output_view(window, self.view), call_sites, expansions, change_count)
+        sublime.set_timeout_async(batch.start)
+
+
+class RustAnalyzerExpansionCacheListener(sublime_plugin.EventListener):
+
+    def on_post_save_async(self, view: sublime.View) -> None:
+        # Macros defined in the saved file may be used by any other file.
+        if view.match_selector(0, 'source.rust'):
+            clear_expansion_cache(keep=text_document_identifier(view)['uri'])
+
+    def on_close(self, view: sublime.View) -> None:
+        if batch := _batches.pop(view.id(), None):
+            batch.cancelled = True
+        _output_views.pop(view.id(), None)
@@ -0,0 +1,482 @@
+from __future__ import annotations
+
+from .plugin import get_package_setting
+from .plugin import Runnable
+from .plugin import runnable_command
+from .server_installer import sha256_of
+from .server_tuning import physical_core_count
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from LSP.plugin import LspTextCommand
+from LSP.plugin import Request
+from LSP.plugin.core.views import text_document_identifier
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Literal
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+from typing import TypedDict
+import json
+import os
+import re
+import shutil
+import sublime
+import subprocess
+import threading
+import time
+
+PANEL_NAME = 'rust-analyzer-tests'
+
+FLUSH_DELAY_MS = 50
+"""Output of the test processes is collected for this long before it is appended to the panel."""
+
+TEST_RESULT_PATTERN = re.compile(r'^test (\S+) \.\.\. (ok|FAILED|ignored)')
+PANIC_PATTERN = re.compile(r"^thread '([^']+)' panicked at (?:'.*', )?([^\s:]+):(\d+):(\d+)")
+
+# Matches both the panic messages in the test output and the failures listed in the summary.
+RESULT_FILE_REGEX = r"(?:panicked at (?:'.*', )?|^)([^\s:]+\.rs):(\d+):(\d+)"
+
+TestScope = Literal['file', 'module', 'crate']
+
+
+class TestJob(TypedDict):
+    label: str
+    cmd: List[str]
+    cwd: str
+
+
+class JobResult(TypedDict):
+    label: str
+    returncode: int
+    # Whether the result was taken from an earlier run with the same inputs.
+    cached: bool
+    # Test name to outcome ("ok", "FAILED" or "ignored").
+    tests: Dict[str, str]
+    # Test name to the "file:line:col" location it panicked at.
+    panics: Dict[str, str]
+
+
+# The modification time in nanoseconds, the size and, once known, the sha256 digest of a file.
+FileState = Tuple[int, int, Optional[str]]
+
+# The state of every input file of a crate by path.
+Fingerprint = Dict[str, FileState]
+
+JobKey = Tuple[str, Tuple[str, ...]]
+
+HASHED_SUFFIXES = {'.rs'}
+HASHED_NAMES = {'Cargo.toml', 'Cargo.lock', 'pyproject.toml', 'setup.py'}
+"""The sources and manifests, which are worth hashing to tell touched from changed ones. Other files are only stat'ed."""
+
+
+class PassedRun(NamedTuple):
+    fingerprint: Fingerprint
+    result: JobResult
+
+
+_passed_runs: dict[JobKey, PassedRun] = {}
+"""The last passing run of each job, with the fingerprint of the inputs it ran with."""
+
+_known_files: Fingerprint = {}
+"""The last seen state of each input file including its digest, to avoid hashing unchanged files again."""
+
+
+def crate_fingerprint(crate_dir: Path, lock_file: Path, previous: Fingerprint | None = None) -> Fingerprint:
+    """
+    Record the modification time and size of every file of the crate (except build output) and of `Cargo.lock`.
+
+    Digests known from `previous` are carried over for files whose modification time and size didn't change.
+    """
+    previous = previous or {}
+    fingerprint: Fingerprint = {}
+    paths = [lock_file] if lock_file.is_file() else []
+    for root, dirs, files in os.walk(crate_dir):
+        dirs[:] = [d for d in dirs if d != 'target' and not d.startswith('.')]
+        paths.extend(Path(root, name) for name in files)
+    for path in paths:
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        key = str(path)
+        known = previous.get(key)
+        digest = known[2] if known and known[:2] == (stat.st_mtime_ns, stat.st_size) else None
+        fingerprint[key] = (stat.st_mtime_ns, stat.st_size, digest)
+    return fingerprint
+
+
+def is_hashed(path: str) -> bool:
+    name = os.path.basename(path)
+    return name in HASHED_NAMES or os.path.splitext(name)[1] in HASHED_SUFFIXES
+
+
+def with_digests(fingerprint: Fingerprint, known: Fingerprint) -> Fingerprint:
+    """
+    Add the digests of the sources and manifests whose modification time or size changed since they were `known`.
+
+    Files seen for the first time aren't hashed, as there is no earlier digest that a change could be compared with.
+    A file that changes while it is hashed keeps no digest, so that a digest always belongs to the recorded state.
+    """
+    digested: Fingerprint = {}
+    for path, state in fingerprint.items():
+        previous = known.get(path)
+        if state[2] is None and previous is not None and previous[:2] != state[:2] and is_hashed(path):
+            try:
+                digest = sha256_of(Path(path))
+                stat = os.stat(path)
+            except OSError:
+                digest = None
+            else:
+                if (stat.st_mtime_ns, stat.st_size) != state[:2]:
+                    digest = None
+            state = (state[0], state[1], digest)
+        digested[path] = state
+    return digested
+
+
+def is_unchanged(stored: Fingerprint, current: Fingerprint) -> bool:
+    """
+    Whether the files in `current` are those of `stored`.
+
+    Files are compared by modification time and size. Files that were only touched are recognized by their digest.
+    """
+    if stored.keys() != current.keys():
+        return False
+    for path, (mtime, size, digest) in current.items():
+        stored_mtime, stored_size, stored_digest = stored[path]
+        if (mtime, size) == (stored_mtime, stored_size):
+            continue
+        if size != stored_size or stored_digest is None or digest != stored_digest:
+            return False
+    return True
+
+
+def crate_dir_of(file_name: str | None) -> Path | None:
+    """The directory of the `Cargo.toml` closest to `file_name`."""
+    if not file_name:
+        return None
+    for directory in Path(file_name).parents:
+        if (directory / 'Cargo.toml').is_file():
+            return directory
+    return None
+
+
+def is_single_test(runnable: Runnable) -> bool:
+    args = runnable['args']
+    return (
+        runnable['kind'] == 'cargo'
+        and args.get('cargoArgs', [])[:1] == ['test']
+        and '--exact' in (args.get('executableArgs') or [])
+    )
+
+
+def is_test_module(runnable: Runnable) -> bool:
+    args = runnable['args']
+    return (
+        runnable['kind'] == 'cargo'
+        and args.get('cargoArgs', [])[:1] == ['test']
+        and bool(args.get('executableArgs'))
+        and '--exact' not in args['executableArgs']
+    )
+
+
+def runnable_job(runnable: Runnable) -> TestJob:
+    return {'label': runnable['label'], 'cmd': runnable_command(runnable), 'cwd': runnable['args']['workspaceRoot']}
+
+
+def test_jobs(tests: list[Runnable]) -> list[TestJob]:
+    """
+    One job per test target of the single test runnables, which passes all test names to libtest as filters.
+
+    Separate `cargo test` processes would all wait for the lock on the build directory, and libtest runs the tests of
+    one process in parallel anyway.
+    """
+    groups: dict[tuple[str, tuple[str, ...], tuple[str, ...], str], list[Runnable]] = {}
+    for test in tests:
+        args = test['args']
+        # The test name comes first, followed by flags such as `--exact` that all tests of the target share.
+        flags = tuple(args['executableArgs'][1:])
+        key = (args.get('overrideCargo') or 'cargo', tuple(args.get('cargoArgs', [])), flags, args['workspaceRoot'])
+        groups.setdefault(key, []).append(test)
+    jobs: list[TestJob] = []
+    for (cargo, cargo_args, flags, cwd), group in groups.items():
+        if len(group) == 1:
+            jobs.append(runnable_job(group[0]))
+            continue
+        names = [test['args']['executableArgs'][0] for test in group]
+        jobs.append({
+            'label': f'{" ".join(cargo_args)} ({len(group)} tests)',
+            'cmd': [cargo, *cargo_args, '--', *names, *flags],
+            'cwd': cwd,
+        })
+    return jobs
+
+
+def module_at(runnables: list[Runnable], line: int) -> str | None:
+    """The path of the innermost test module that contains `line`."""
+    innermost: tuple[int, str] | None = None
+    for runnable in runnables:
+        location = runnable.get('location')
+        if not location or not is_test_module(runnable):
+            continue
+        target_range = location['targetRange']
+        start, end = target_range['start']['line'], target_range['end']['line']
+        if start <= line <= end and (innermost is None or start > innermost[0]):
+            innermost = (start, runnable['args']['executableArgs'][0])
+    return innermost[1] if innermost else None
+
+
+def crate_jobs(runnables: list[Runnable]) -> list[TestJob]:
+    """One job per test target of the package the runnables belong to, determined through `cargo metadata`."""
+    for runnable in runnables:
+        cargo_args = runnable['args'].get('cargoArgs', [])
+        if runnable['kind'] == 'cargo' and '--package' in cargo_args[:-1]:
+            break
+    else:
+        return []
+    args = runnable['args']
+    package = cargo_args[cargo_args.index('--package') + 1]
+    cargo = args.get('overrideCargo') or 'cargo'
+    output = subprocess.run(
+        [cargo, 'metadata', '--no-deps', '--format-version', '1'], cwd=args['workspaceRoot'],
+        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+        startupinfo=startupinfo()).stdout
+    jobs: list[TestJob] = []
+    for metadata_package in json.loads(output)['packages']:
+        if metadata_package['name'] != package:
+            continue
+        for target in metadata_package['targets']:
+            kinds = set(target['kind'])
+            target_args: list[list[str]] = []
+            if kinds & {'lib', 'rlib', 'dylib', 'proc-macro'}:
+                target_args.append(['--lib'])
+                if target.get('doctest'):
+                    target_args.append(['--doc'])
+            elif 'bin' in kinds:
+                target_args.append(['--bin', target['name']])
+            elif 'test' in kinds:
+                target_args.append(['--test', target['name']])
+            for extra in target_args:
+                jobs.append({
+                    'label': f'test {package} {" ".join(extra)}',
+                    'cmd': [cargo, 'test', '--package', package, *extra],
+                    'cwd': args['workspaceRoot'],
+                })
+    return jobs
+
+
+def startupinfo() -> subprocess.STARTUPINFO | None:  # type: ignore
+    if sublime.platform() != 'windows':
+        return None
+    info = subprocess.STARTUPINFO()  # type: ignore
+    info.dwFlags |= subprocess.STARTF_USESHOWWINDOW  # type: ignore
+    return info
+
+
+class OutputPanel:
+    """An output panel that can be appended to from any thread. Appends are coalesced."""
+
+    def __init__(self, window: sublime.Window, base_dir: str) -> None:
+        self.window = window
+        self.view = window.create_output_panel(PANEL_NAME)
+        settings = self.view.settings()
+        settings.set('result_file_regex', RESULT_FILE_REGEX)
+        settings.set('result_base_dir', base_dir)
+        settings.set('line_numbers', False)
+        settings.set('gutter', False)
+        settings.set('word_wrap', False)
+        self._lock = threading.Lock()
+        self._pending: list[str] = []
+
+    def show(self) -> None:
+        self.window.run_command('show_panel', {'panel': f'output.{PANEL_NAME}'})
+
+    def write(self, text: str) -> None:
+        with self._lock:
+            self._pending.append(text)
+            if len(self._pending) == 1:
+                sublime.set_timeout(self._flush, FLUSH_DELAY_MS)
+
+    def _flush(self) -> None:
+        with self._lock:
+            text = ''.join(self._pending)
+            self._pending.clear()
+        current_run = _current_runs.get(self.window.id())
+        # A cancelled run that is still winding down must not write into the panel of the run that replaced it.
+        if current_run is not None and current_run.panel is self:
+            self.view.run_command('append', {'characters': text, 'force': True, 'scroll_to_end': True})
+
+
+class TestRun:
+    """Runs test jobs as subprocesses, at most `concurrency` at a time, and summarizes the libtest results."""
+
+    def __init__(
+        self, panel: OutputPanel, jobs: list[TestJob], concurrency: int, crate_dir: Path | None, force: bool
+    ) -> None:
+        self.panel = panel
+        self.jobs = jobs
+        self.concurrency = max(1, concurrency)
+        # Passing jobs are skipped when the files of this crate didn't change since, unless forced.
+        self.crate_dir = crate_dir
+        self.force = force
+        self.fingerprint: Fingerprint | None = None
+        self._cancelled = False
+        self._processes: set[subprocess.Popen] = set()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._cancelled = True
+            for process in self._processes:
+                process.terminate()
+
+    def _run(self) -> None:
+        start = time.monotonic()
+        self.panel.write(f'Running {len(self.jobs)} runnables, {self.concurrency} at a time\n\n')
+        if self.crate_dir:
+            lock_file = Path(self.jobs[0]['cwd'], 'Cargo.lock')
+            # Hash the files right away, so that the digests are those of the files the jobs run with. Only changed
+            # files are hashed, the digests of the others are carried over.
+            self.fingerprint = with_digests(crate_fingerprint(self.crate_dir, lock_file, _known_files), _known_files)
+            _known_files.update(self.fingerprint)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(self._run_job, range(len(self.jobs))))
+        if not self._cancelled:
+            self._write_summary(results, time.monotonic() - start)
+
+    def _run_job(self, index: int) -> JobResult:
+        job = self.jobs[index]
+        key: JobKey = (job['label'], tuple(job['cmd']))
+        passed_run = _passed_runs.get(key)
+        if (
+            not self.force and passed_run and self.fingerprint is not None
+            and is_unchanged(passed_run.fingerprint, self.fingerprint)
+        ):
+            self.panel.write(f'[{index + 1}] {job["label"]}: inputs unchanged, passed before (cached)\n')
+            return dict(passed_run.result, cached=True)  # type: ignore
+        result: JobResult = {'label': job['label'], 'returncode': -1, 'cached': False, 'tests': {}, 'panics': {}}
+        with self._lock:
+            if self._cancelled:
+                return result
+            try:
+                process = subprocess.Popen(
+                    job['cmd'], cwd=job['cwd'], env=dict(os.environ, CARGO_TERM_COLOR='never'),
+                    stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    universal_newlines=True, encoding='utf-8', errors='replace', startupinfo=startupinfo())
+            except OSError as ex:
+                self.panel.write(f'[{index + 1}] Failed to run {job["label"]}: {ex}\n')
+                return result
+            self._processes.add(process)
+        self.panel.write(f'[{index + 1}] {" ".join(job["cmd"])}\n')
+        assert process.stdout
+        for line in process.stdout:
+            self.panel.write(f'[{index + 1}] {line}')
+            if match := TEST_RESULT_PATTERN.match(line):
+                result['tests'][match.group(1)] = match.group(2)
+            elif match := PANIC_PATTERN.match(line):
+                result['panics'][match.group(1)] = f'{match.group(2)}:{match.group(3)}:{match.group(4)}'
+        result['returncode'] = process.wait()
+        with self._lock:
+            self._processes.discard(process)
+        if result['returncode'] == 0 and self.fingerprint is not None and not self._cancelled:
+            _passed_runs[key] = PassedRun(self.fingerprint, result)
+        else:
+            _passed_runs.pop(key, None)
+        return result
+
+    def _write_summary(self, results: list[JobResult], seconds: float) -> None:
+        outcomes = [outcome for result in results for outcome in result['tests'].values()]
+        lines = [
+            '',
+            f'{outcomes.count("ok")} passed, {outcomes.count("FAILED")} failed, {outcomes.count("ignored")} ignored '
+            f'in {len(results)} runnables, {sum(result["cached"] for result in results)} cached ({seconds:.1f}s)',
+        ]
+        for result in results:
+            for name, outcome in result['tests'].items():
+                if outcome == 'FAILED':
+                    location = result['panics'].get(name)
+                    lines.append(f'{location}: FAILED {name}' if location else f'FAILED {name}')
+            if result['returncode'] != 0 and not any(o == 'FAILED' for o in result['tests'].values()):
+                lines.append(f'ERROR {result["label"]} exited with status {result["returncode"]}')
+        self.panel.write('\n'.join(lines) + '\n')
+
+
+_current_runs: dict[int, TestRun] = {}
+"""The test run per window id. Starting a new run cancels the previous one of the window."""
+
+
+class RustAnalyzerRunTestsCommand(LspTextCommand):
+    """Run the tests of the current file, test module or crate in parallel and summarize the results."""
+
+    def is_enabled(self, scope: TestScope = 'file', force: bool = False) -> bool:
+        selection = self.view.sel()
+        if len(selection) == 0:
+            return False
+        return super().is_enabled()
+
+    def run(self, edit: sublime.Edit, scope: TestScope = 'file', force: bool = False) -> None:
+        session = self.session_by_name(self.session_name)
+        if session is None:
+            return
+        line = self.view.rowcol(self.view.sel()[0].b)[0]
+        # Without a position, all runnables of the document are returned.
+        params = {'textDocument': text_document_identifier(self.view), 'position': None}
+        session.send_request(
+            Request("experimental/runnables", params), partial(self.on_result_async, scope, line, force))
+
+    def on_result_async(self, scope: TestScope, line: int, force: bool, runnables: list[Runnable]) -> None:
+        if scope == 'crate':
+            # `cargo metadata` can take a moment, so don't block the async thread with it.
+            threading.Thread(target=partial(self.start_crate_run, runnables, force), daemon=True).start()
+            return
+        tests = [runnable for runnable in runnables if is_single_test(runnable)]
+        if scope == 'module':
+            if (module := module_at(runnables, line)) is not None:
+                tests = [
+                    test for test in tests
+                    if test['args']['executableArgs'][0].startswith(f'{module}::')
+                ]
+            else:
+                sublime.status_message('The caret is not inside a test module. Running all tests of the file.')
+        self.start_run(test_jobs(tests), force)
+
+    def start_crate_run(self, runnables: list[Runnable], force: bool) -> None:
+        try:
+            jobs = crate_jobs(runnables)
+        except (OSError, subprocess.CalledProcessError, ValueError, KeyError) as ex:
+            sublime.status_message(f'Failed to determine the test targets of the crate: {ex}')
+            return
+        self.start_run(jobs, force)
+
+    def start_run(self, jobs: list[TestJob], force: bool) -> None:
+        if not jobs:
+            sublime.status_message('No tests to run.')
+            return
+        if not shutil.which(jobs[0]['cmd'][0]):
+            sublime.error_message(
+                f'Cannot run executable "{jobs[0]["cmd"][0]}". Ensure that it is in the PATH of the Sublime Text '
+                'process.')
+            return
+        session = self.session_by_name(self.session_name)
+        window = self.view.window()
+        if session is None or window is None:
+            return
+        concurrency = get_package_setting(session.config, 'testRunnerConcurrency') or physical_core_count()
+        crate_dir = crate_dir_of(self.view.file_name())
+        # This runs on a worker thread, while the panel can only be created on the UI thread.
+        sublime.set_timeout(partial(self.show_run, window, jobs, concurrency, crate_dir, force))
+
+    def show_run(
+        self, window: sublime.Window, jobs: list[TestJob], concurrency: int, crate_dir: Path | None, force: bool
+    ) -> None:
+        if previous_run := _current_runs.pop(window.id(), None):
+            previous_run.cancel()
+        panel = OutputPanel(window, jobs[0]['cwd'])
+        panel.show()
+        test_run = _current_runs[window.id()] = TestRun(panel, jobs, concurrency, crate_dir, force)
+        test_run.start()
@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+from collections import deque
+from functools import partial
+from typing import NamedTuple
+from typing import Sequence
+import os
+import sublime
+import sublime_plugin
+import threading
+import time
+
+STATUS_KEY = 'lsp_rust_analyzer_monitor'
+
+SETTINGS_KEY = 'lsp_rust_analyzer_monitor'
+
+HISTORY_SIZE = 120
+"""The number of samples kept per server process."""
+
+SPARKLINE_BLOCKS = '▁▂▃▄▅▆▇█'
+
+DEFAULT_INTERVAL = 5.0
+"""Seconds between samples when the monitor is started from the command palette."""
+
+PROC = '/proc'
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class ProcessStat(NamedTuple):
+    pid: int
+    ppid: int
+    name: str
+    # Resident set size in bytes.
+    rss: int
+    # User and system CPU time in seconds.
+    cpu: float
+    threads: int
+
+
+class Sample(NamedTuple):
+    """The resource usage of a server process together with all of its descendants (proc-macro-srv, flycheck)."""
+    time: float
+    rss: int
+    cpu: float
+    threads: int
+    processes: int
+
+
+def read_stat(pid: int) -> ProcessStat | None:
+    try:
+        with open(f'{PROC}/{pid}/stat', encoding='utf-8', errors='replace') as f:
+            content = f.read()
+    except OSError:
+        return None
+    # The name is in parentheses and may itself contain spaces and parentheses.
+    name_start, name_end = content.find('('), content.rfind(')')
+    fields = content[name_end + 2:].split()
+    # `fields` starts at the third field of the stat line (state), see proc(5).
+    return ProcessStat(
+        pid=pid,
+        ppid=int(fields[1]),
+        name=content[name_start + 1:name_end],
+        rss=int(fields[21]) * PAGE_SIZE,
+        cpu=(int(fields[11]) + int(fields[12])) / CLOCK_TICKS,
+        threads=int(fields[17]),
+    )
+
+
+def read_all_stats() -> list[ProcessStat]:
+    stats: list[ProcessStat] = []
+    for entry in os.listdir(PROC):
+        if entry.isdigit() and (stat := read_stat(int(entry))):
+            stats.append(stat)
+    return stats
+
+
+def server_process_trees(parent_pid: int) -> dict[int, list[ProcessStat]]:
+    """
+    Find the rust-analyzer processes started by `parent_pid` (the plugin host), each with all of its descendants.
+
+    The server itself is the first element of each list.
+    """
+    stats = read_all_stats()
+    children: dict[int, list[ProcessStat]] = {}
+    for stat in stats:
+        children.setdefault(stat.ppid, []).append(stat)
+    trees: dict[int, list[ProcessStat]] = {}
+    for server in children.get(parent_pid, []):
+        if not server.name.startswith('rust-analyzer'):
+            continue
+        tree = [server]
+        pending = [server.pid]
+        while pending:
+            for child in children.get(pending.pop(), []):
+                tree.append(child)
+                pending.append(child.pid)
+        trees[server.pid] = tree
+    return trees
+
+
+def sparkline(values: list[float]) -> str:
+    if not values:
+        return ''
+    low, high = min(values), max(values)
+    spread = (high - low) or 1
+    return ''.join(SPARKLINE_BLOCKS[int((value - low) / spread * (len(SPARKLINE_BLOCKS) - 1))] for value in values)
+
+
+def format_mib(size: int) -> str:
+    return f'{size / (1 << 20):.0f} MiB'
+
+
+def cpu_percent(samples: Sequence[Sample]) -> float:
+    if len(samples) < 2:
+        return 0.0
+    previous, latest = samples[-2], samples[-1]
+    return 100 * (latest.cpu - previous.cpu) / max(latest.time - previous.time, 1e-6)
+
+
+class ServerMonitor:
+    """
+    Samples the rust-analyzer processes and their children through `/proc` at a fixed interval.
+
+    Unlike the `rust-analyzer/memoryUsage` request, sampling doesn't affect the server in any way.
+    """
+
+    def __init__(self) -> None:
+        self.interval = DEFAULT_INTERVAL
+        self.rss_alert: int | None = None
+        # Whether the monitor was started because of the `server_monitor_interval` setting.
+        self.from_setting = False
+        # Written by the sampling thread, so only read them while holding the lock.
+        self.history: dict[int, deque[Sample]] = {}
+        self.latest_trees: dict[int, list[ProcessStat]] = {}
+        self._lock = threading.Lock()
+        self._alerted: set[int] = set()
+        self._stop: threading.Event | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._stop is not None
+
+    def start(self, interval: float, rss_alert_mib: int | None, from_setting: bool = False) -> None:
+        self.interval = interval
+        self.rss_alert = rss_alert_mib << 20 if rss_alert_mib else None
+        self.from_setting = from_setting
+        if self._stop is None:
+            self._stop = threading.Event()
+            threading.Thread(target=partial(self._loop, self._stop), daemon=True).start()
+
+    def stop(self) -> None:
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+        sublime.set_timeout(partial(self._show_status, ''))
+
+    def on_settings_changed(self) -> None:
+        """Follow changes of the settings that started the monitor, and stop it when they are removed."""
+        if not self.running or not self.from_setting:
+            return
+        settings = sublime.load_settings('LSP-rust-analyzer.sublime-settings')
+        if interval := settings.get('server_monitor_interval'):
+            self.start(interval, settings.get('server_monitor_rss_alert_mib'), from_setting=True)
+        else:
+            self.stop()
+
+    def _loop(self, stop: threading.Event) -> None:
+        while not stop.is_set():
+            self.sample()
+            stop.wait(self.interval)
+
+    def sample(self) -> None:
+        now = time.monotonic()
+        trees = server_process_trees(os.getpid())
+        samples: dict[int, Sample] = {}
+        with self._lock:
+            for pid in list(self.history):
+                if pid not in trees:
+                    del self.history[pid]
+                    self._alerted.discard(pid)
+            for pid, tree in trees.items():
+                samples[pid] = Sample(
+                    time=now,
+                    rss=sum(stat.rss for stat in tree),
+                    cpu=sum(stat.cpu for stat in tree),
+                    threads=sum(stat.threads for stat in tree),
+                    processes=len(tree),
+                )
+                self.history.setdefault(pid, deque(maxlen=HISTORY_SIZE)).append(samples[pid])
+            self.latest_trees = trees
+        for pid, sample in samples.items():
+            self._check_alert(pid, sample)
+        sublime.set_timeout(partial(self._show_status, self.status_text()))
+
+    def snapshot(self) -> tuple[dict[int, list[Sample]], dict[int, list[ProcessStat]]]:
+        """A copy of the history and of the latest process trees."""
+        with self._lock:
+            return {pid: list(samples) for pid, samples in self.history.items()}, dict(self.latest_trees)
+
+    def status_text(self) -> str:
+        history, _ = self.snapshot()
+        parts = [f'{format_mib(samples[-1].rss)}, {cpu_percent(samples):.0f}% CPU' for samples in history.values()]
+        return f'rust-analyzer: {" | ".join(parts)}' if parts else ''
+
+    def _check_alert(self, pid: int, sample: Sample) -> None:
+        if self.rss_alert is None:
+            return
+        if sample.rss < self.rss_alert:
+            self._alerted.discard(pid)
+            return
+        if pid in self._alerted:
+            return
+        self._alerted.add(pid)
+        message = (
+            f'rust-analyzer (pid {pid}) uses {format_mib(sample.rss)}, above the alert threshold of '
+            f'{format_mib(self.rss_alert)}. Consider lowering "lru.capacity" or excluding directories from analysis.'
+        )
+        print(f'LSP-rust-analyzer: {message}')
+        sublime.set_timeout(partial(sublime.status_message, message))
+
+    def _show_status(self, text: str) -> None:
+        # Every view shows it, so that the status doesn't change when switching views.
+        for window in sublime.windows():
+            for view in window.views():
+                if text:
+                    view.set_status(STATUS_KEY, text)
+                else:
+                    view.erase_status(STATUS_KEY)
+
+    def report(self) -> str:
+        history, latest_trees = self.snapshot()
+        if not history:
+            return 'No rust-analyzer server processes found.\n'
+        lines: list[str] = []
+        for pid, samples in history.items():
+            latest = samples[-1]
+            lines.append(f'rust-analyzer (pid {pid})')
+            lines.append(f'  Memory:  {format_mib(latest.rss)} in {latest.processes} processes')
+            lines.append(f'  CPU:     {cpu_percent(samples):.0f}% ({latest.cpu:.0f}s in total)')
+            lines.append(f'  Threads: {latest.threads}')
+            lines.append(f'  Memory over the last {len(samples)} samples ({self.interval:g}s apart):')
+            lines.append(f'    {sparkline([sample.rss for sample in samples])}')
+            lowest, highest = min(s.rss for s in samples), max(s.rss for s in samples)
+            lines.append(f'    min {format_mib(lowest)}, max {format_mib(highest)}')
+            lines.append('  Processes:')
+            for stat in latest_trees.get(pid, []):
+                lines.append(f'    {stat.pid:>7} {stat.name:<20} {format_mib(stat.rss):>10} {stat.threads:>4} threads')
+            lines.append('')
+        return '\n'.join(lines)
+
+
+server_monitor = ServerMonitor()
+
+
+def is_supported() -> bool:
+    return os.path.isdir(PROC) and sublime.platform() == 'linux'
+
+
+class RustAnalyzerToggleServerMonitorCommand(sublime_plugin.ApplicationCommand):
+
+    def is_enabled(self) -> bool:
+        return is_supported()
+
+    def run(self) -> None:
+        if server_monitor.running:
+            server_monitor.stop()
+            sublime.status_message('rust-analyzer resource monitor stopped')
+        else:
+            settings = sublime.load_settings('LSP-rust-analyzer.sublime-settings')
+            interval = settings.get('server_monitor_interval') or DEFAULT_INTERVAL
+            server_monitor.start(interval, settings.get('server_monitor_rss_alert_mib'))
+            sublime.status_message('rust-analyzer resource monitor started')
+
+
+class RustAnalyzerShowServerMonitorCommand(sublime_plugin.WindowCommand):
+
+    def is_enabled(self) -> bool:
+        return is_supported()
+
+    def run(self) -> None:
+        if not server_monitor.running:
+            # Take a single sample so that there is something to show.
+            server_monitor.sample()
+        view = self.window.new_file(flags=sublime.TRANSIENT)
+        view.set_scratch(True)
+        view.set_name("--- RustAnalyzer Server Resources ---")
+        view.run_command("append", {"characters": server_monitor.report()})
+        view.set_read_only(True)
+
+
+def plugin_loaded() -> None:
+    settings = sublime.load_settings('LSP-rust-analyzer.sublime-settings')
+    settings.add_on_change(SETTINGS_KEY, server_monitor.on_settings_changed)
+
+
+def plugin_unloaded() -> None:
+    sublime.load_settings('LSP-rust-analyzer.sublime-settings').clear_on_change(SETTINGS_KEY)
+    server_monitor.stop()
@@ -1,12 +1,17 @@
 from __future__ import annotations
 
+from array import array
+from bisect import bisect_right
 from functools import partial
+from heapq import nsmallest
 from LSP.plugin import LspTextCommand
 from LSP.plugin import Promise
 from LSP.plugin import Request
 from LSP.plugin.core.tree_view import new_tree_view_sheet
 from LSP.plugin.core.tree_view import TreeDataProvider
 from LSP.plugin.core.tree_view import TreeItem
+from LSP.plugin.core.tree_view import TreeItemCollapsibleState
+from LSP.plugin.core.tree_view import TreeViewSheet
 from LSP.plugin.core.views import text_document_position_params
 from LSP.protocol import NotRequired
 from LSP.protocol import Range
@@ -29,27 +34,6 @@ class InnerNode(TypedDict):
     range: Range
     offsets: Offsets
 
-class SyntaxNode(TypedDict):
-    type: Literal['Node']
-    kind: str
-    offsets: Offsets
-    range: Range
-    # This element's position within a Rust string literal, if it's inside of one.
-    inner: InnerNode | None
-    parent: SyntaxElement | None
-    children: list[SyntaxElement]
-
-class SyntaxToken(TypedDict):
-    type: Literal['Token']
-    kind: str
-    range: Range
-    offsets: Offsets
-    # This element's position within a Rust string literal, if it's inside of one.
-    inner: InnerNode | None
-    parent: SyntaxElement | None
-
-SyntaxElement = Union[SyntaxNode, SyntaxToken]
-
 class RawNode(TypedDict):
     type: Literal['Node']
     kind: str
@@ -57,7 +41,7 @@ class RawNode(TypedDict):
     end: Tuple[int, int, int]
     istart: NotRequired[Tuple[int, int, int]]
     iend: NotRequired[Tuple[int, int, int]]
-    children: list[SyntaxElement]
+    children: list[int]
 
 class RawToken(TypedDict):
     type: Literal['Token']
@@ -69,148 +53,393 @@ class RawToken(TypedDict):
 
 RawElement = Union[RawNode, RawToken]
 
+LIVE_UPDATE_DELAY_MS = 300
+"""Time that edits and caret moves must have settled before a live syntax tree is updated."""
+
+MAX_FILTER_RESULTS = 1000
+"""Upper limit on the number of top-level elements shown in a syntax tree filtered by kind."""
+
+# (offset, line, character) triples of an element's start and end within a Rust string literal.
+RawInner = Tuple[Tuple[int, int, int], Tuple[int, int, int]]
+
+
+class SyntaxTree:
+    """
+    A syntax tree stored as parallel arrays indexed by element.
+
+    Elements are numbered in post-order (children before their parent), so the root is the last element.
+    Element kinds are interned. The rare positions within Rust string literals are kept in a separate dict.
+    """
+
+    def __init__(self) -> None:
+        self.kind_names: list[str] = []
+        self.kind_ids: dict[str, int] = {}
+        self.kinds = array('i')
+        self.is_node = bytearray()
+        self.start_offsets = array('i')
+        self.end_offsets = array('i')
+        self.start_lines = array('i')
+        self.start_characters = array('i')
+        self.end_lines = array('i')
+        self.end_characters = array('i')
+        self.parents = array('i')
+        self.first_children = array('i')
+        self.next_siblings = array('i')
+        self.inner: dict[int, RawInner] = {}
+        # Tokens partition the document and are added in document order, so their start positions are sorted and
+        # form an interval index that maps a position to the innermost element.
+        self.token_indices = array('i')
+        self.token_starts = array('q')
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    @property
+    def root(self) -> SyntaxElement:
+        return SyntaxElement(self, len(self) - 1)
+
+    def find_kind(self, kind_filter: str, limit: int | None = None) -> list[SyntaxElement]:
+        """
+        Return the elements whose kind contains `kind_filter` (ignoring case) in document order, at most `limit`.
+
+        Only the kind ids are compared, so no element views are created for elements that don't match or that are
+        beyond the limit.
+        """
+        needle = kind_filter.lower()
+        kind_ids = {kind_id for kind_id, name in enumerate(self.kind_names) if needle in name.lower()}
+        if not kind_ids:
+            return []
+        indices = [index for index, kind_id in enumerate(self.kinds) if kind_id in kind_ids]
+
+        def document_order(index: int) -> tuple[int, int]:
+            # Post-order puts a parent after its children, while an outer element should come first.
+            return self.start_offsets[index], -self.end_offsets[index]
+
+        if limit is not None and limit < len(indices):
+            indices = nsmallest(limit, indices, key=document_order)
+        else:
+            indices.sort(key=document_order)
+        return [SyntaxElement(self, index) for index in indices]
+
+    def element_at(self, line: int, character: int) -> SyntaxElement | None:
+        """Return the token at the (UTF-16) position, preferring the token that starts there."""
+        position = bisect_right(self.token_starts, (line << 32) | character) - 1
+        if position < 0:
+            return None
+        return SyntaxElement(self, self.token_indices[position])
+
+    def add(self, value: RawElement) -> int:
+        index = len(self.kinds)
+        kind = value['kind']
+        kind_id = self.kind_ids.get(kind)
+        if kind_id is None:
+            kind_id = self.kind_ids[kind] = len(self.kind_names)
+            self.kind_names.append(kind)
+        self.kinds.append(kind_id)
+        start_offset, start_line, start_character = value['start']
+        end_offset, end_line, end_character = value['end']
+        self.start_offsets.append(start_offset)
+        self.end_offsets.append(end_offset)
+        self.start_lines.append(start_line)
+        self.start_characters.append(start_character)
+        self.end_lines.append(end_line)
+        self.end_characters.append(end_character)
+        if (istart := value.get('istart')) and (iend := value.get('iend')):
+            self.inner[index] = (istart, iend)
+        self.parents.append(-1)
+        self.next_siblings.append(-1)
+        children: list[int] = value.get('children', []) if value['type'] == 'Node' else []
+        if value['type'] == 'Token':
+            self.token_indices.append(index)
+            self.token_starts.append((start_line << 32) | start_character)
+        self.is_node.append(value['type'] == 'Node')
+        self.first_children.append(children[0] if children else -1)
+        for child, sibling in zip(children, children[1:]):
+            self.next_siblings[child] = sibling
+        for child in children:
+            self.parents[child] = index
+        return index
+
+
+class SyntaxElement:
+    """A lightweight view on a single element of a `SyntaxTree`."""
+
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree: SyntaxTree, index: int) -> None:
+        self.tree = tree
+        self.index = index
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, SyntaxElement) and self.tree is other.tree and self.index == other.index
+
+    def __hash__(self) -> int:
+        return hash((id(self.tree), self.index))
+
+    @property
+    def type(self) -> Literal['Node', 'Token']:
+        return 'Node' if self.tree.is_node[self.index] else 'Token'
+
+    @property
+    def kind(self) -> str:
+        return self.tree.kind_names[self.tree.kinds[self.index]]
+
+    @property
+    def offsets(self) -> Offsets:
+        return {'start': self.tree.start_offsets[self.index], 'end': self.tree.end_offsets[self.index]}
+
+    @property
+    def range(self) -> Range:
+        tree, index = self.tree, self.index
+        return {
+            'start': {'line': tree.start_lines[index], 'character': tree.start_characters[index]},
+            'end': {'line': tree.end_lines[index], 'character': tree.end_characters[index]},
+        }
+
+    @property
+    def inner(self) -> InnerNode | None:
+        """This element's position within a Rust string literal, if it's inside of one."""
+        if (inner := self.tree.inner.get(self.index)) is None:
+            return None
+        (start_offset, start_line, start_character), (end_offset, end_line, end_character) = inner
+        return {
+            'offsets': {'start': start_offset, 'end': end_offset},
+            'range': {
+                'start': {'line': start_line, 'character': start_character},
+                'end': {'line': end_line, 'character': end_character},
+            },
+        }
+
+    @property
+    def parent(self) -> SyntaxElement | None:
+        parent = self.tree.parents[self.index]
+        return SyntaxElement(self.tree, parent) if parent != -1 else None
+
+    @property
+    def ancestors(self) -> list[SyntaxElement]:
+        """This element and all elements containing it, innermost first."""
+        tree = self.tree
+        ancestors: list[SyntaxElement] = []
+        index = self.index
+        while index != -1:
+            ancestors.append(SyntaxElement(tree, index))
+            index = tree.parents[index]
+        return ancestors
+
+    @property
+    def children(self) -> list[SyntaxElement]:
+        tree = self.tree
+        children: list[SyntaxElement] = []
+        child = tree.first_children[self.index]
+        while child != -1:
+            children.append(SyntaxElement(tree, child))
+            child = tree.next_siblings[child]
+        return children
+
 
 def parseSyntaxTree(value: str) -> SyntaxElement:
+    tree = SyntaxTree()
 
-    def object_hook(value: RawElement) -> SyntaxElement:
-        if value['type'] != 'Node' and value['type'] != 'Token':
+    def object_hook(value: dict[str, Any]) -> Any:
+        if value.get('type') != 'Node' and value.get('type') != 'Token':
             # This is something other than a RawElement.
             return value
+        return tree.add(cast('RawElement', value))
 
-        startOffset, startLine, startCol = value['start']
-        endOffset, endLine, endCol = value['end']
-        range: Range = {
-            'start': {
-                'line': startLine,
-                'character': startCol,
-            },
-            'end': {
-                'line': endLine,
-                'character': endCol
-            }
-        }
-        offsets: Offsets = {
-            'start': startOffset,
-            'end': endOffset,
-        }
-
-        inner: InnerNode | None = None
-        if (istart := value.get('istart')) and (iend := value.get('iend')):
-            istartOffset, istartLine, istartCol = istart
-            iendOffset, iendLine, iendCol = iend
-            inner = {
-                'offsets': {
-                    'start': istartOffset,
-                    'end': iendOffset,
-                },
-                'range': {
-                    'start': {
-                        'line': istartLine,
-                        'character': istartCol
-                    },
-                    'end': {
-                        'line': iendLine,
-                        'character': iendCol
-                    }
-                }
-            }
-
-        if value['type'] == 'Node':
-            result: SyntaxNode = {
-                'type': value['type'],
-                'kind': value['kind'],
-                'offsets': offsets,
-                'range': range,
-                'inner': inner,
-                'children': value.get('children', []),
-                'parent': None,
-            }
-
-            for child in result['children']:
-                child['parent'] = result
-
-            return result
-        else:
-            return {
-                'type': value['type'],
-                'kind': value['kind'],
-                'offsets': offsets,
-                'range': range,
-                'inner': inner,
-                'parent': None,
-            }
-
-    return json.loads(value, object_hook=lambda v: object_hook(cast('RawElement', v)))
+    json.loads(value, object_hook=object_hook)
+    return tree.root
 
 
 class SyntaxTreeProvider(TreeDataProvider):
 
-    def __init__(self, root_element: SyntaxElement, view_id: int) -> None:
-        self.root_element = root_element
+    def __init__(
+        self, root_elements: list[SyntaxElement], view_id: int, revealed: list[SyntaxElement] | None = None
+    ) -> None:
+        self.root_elements = root_elements
         self.view_id = view_id
+        # Elements that are shown expanded, i.e. the path to the element under the caret in a live tree.
+        self.revealed = {element.index for element in revealed or ()}
 
     def get_children(self, element: SyntaxElement | None) -> Promise[list[SyntaxElement]]:
+        # The views on the children are only created once an element gets expanded.
         if element is None:
-            return Promise.resolve([self.root_element])
-        return Promise.resolve(element.get('children', []))
+            return Promise.resolve(self.root_elements)
+        return Promise.resolve(element.children)
 
     def get_tree_item(self, element: SyntaxElement) -> TreeItem:
-        inner = element.get('inner', {})
-        offsets = inner['offsets'] if inner else element['offsets']
+        inner = element.inner
+        offsets = inner['offsets'] if inner else element.offsets
         offsets_text = f'{offsets["start"]}..{offsets["end"]}'
-        return TreeItem(
-            label=f'{element["kind"]}',
-            description=f'({element["type"]} - {offsets_text})',
+        tree_item = TreeItem(
+            label=f'{element.kind}',
+            description=f'({element.type} - {offsets_text})',
             action_command=('rust_analyzer_syntax_tree_click_node', {
                 'view_id': self.view_id,
-                'range': element['range'],
+                'range': element.range,
             })
         )
+        if element.index in self.revealed and element.type == 'Node':
+            tree_item.collapsible_state = TreeItemCollapsibleState.EXPANDED
+        return tree_item
+
+
+class KindFilterInputHandler(sublime_plugin.TextInputHandler):
+
+    def name(self) -> str:
+        return 'kind_filter'
+
+    def placeholder(self) -> str:
+        return 'Node or token kind, e.g. FN or LITERAL'
+
+
+class LiveSyntaxTree:
+    """A syntax tree sheet that follows the edits and the caret of its view."""
+
+    def __init__(self) -> None:
+        self.sheet: TreeViewSheet | None = None
+        self.root_element: SyntaxElement | None = None
+        self.change_count = -1
+        self.revealed: list[SyntaxElement] = []
+        # Incremented on every edit or caret move to debounce the updates.
+        self.generation = 0
+
+    def is_closed(self) -> bool:
+        return self.sheet is not None and self.sheet.window() is None
+
+
+_live_trees: dict[int, LiveSyntaxTree] = {}
+"""The live syntax trees by the id of the view they belong to."""
+
+
+def live_tree_of(view: sublime.View) -> LiveSyntaxTree:
+    """The live syntax tree of the view, a new one if its sheet was closed."""
+    live_tree = _live_trees.get(view.id())
+    if live_tree is None or live_tree.is_closed():
+        live_tree = _live_trees[view.id()] = LiveSyntaxTree()
+    return live_tree
 
 
 class RustAnalyzerSyntaxTreeCommand(LspTextCommand):
 
-    def is_enabled(self) -> bool:
+    def is_enabled(self, kind_filter: str | None = None, live: bool = False) -> bool:
         selection = self.view.sel()
         if len(selection) == 0:
             return False
         return super().is_enabled()
 
-    def run(self, edit: sublime.Edit) -> None:
+    def input(self, args: dict[str, Any]) -> sublime_plugin.TextInputHandler | None:
+        if 'kind_filter' in args and args['kind_filter'] is None:
+            return KindFilterInputHandler()
+        return None
+
+    def run(self, edit: sublime.Edit, kind_filter: str | None = None, live: bool = False) -> None:
+        change_count = self.view.change_count()
+        if live:
+            live_tree = live_tree_of(self.view)
+            if live_tree.root_element is not None and live_tree.change_count == change_count:
+                # The document didn't change, only the caret might have moved.
+                self.reveal_caret(live_tree)
+                return
         session = self.session_by_name(self.session_name)
         if session is None:
             return
         params = text_document_position_params(self.view, self.view.sel()[0].b)
         session.send_request(
             Request("rust-analyzer/viewSyntaxTree", params),
-            lambda response: sublime.set_timeout(partial(self.on_result, response))
-        )
+            partial(self.on_result_async, kind_filter, live, change_count))
 
-    def on_result(self, out: str) -> None:
-        session = self.session_by_name(self.session_name)
-        if session is None:
+    def on_result_async(self, kind_filter: str | None, live: bool, change_count: int, out: str) -> None:
+        if live and change_count != self.view.change_count():
+            # Outdated, another request follows once the edits settle.
+            return
+        # Parse off the UI thread. Only the creation of the sheet has to happen on it.
+        root_element = parseSyntaxTree(out)
+        if live:
+            live_tree = live_tree_of(self.view)
+            live_tree.root_element = root_element
+            live_tree.change_count = change_count
+            live_tree.revealed = []
+            self.reveal_caret(live_tree)
+            return
+        if kind_filter:
+            # One more than shown, to know whether there are more.
+            root_elements = root_element.tree.find_kind(kind_filter, limit=MAX_FILTER_RESULTS + 1)
+            if not root_elements:
+                sublime.status_message(f'No syntax tree elements of kind "{kind_filter}"')
+                return
+            if len(root_elements) > MAX_FILTER_RESULTS:
+                sublime.status_message(f'Showing the first {MAX_FILTER_RESULTS} elements of kind "{kind_filter}"')
+                root_elements = root_elements[:MAX_FILTER_RESULTS]
+            sheet_name = f'Syntax Tree ({kind_filter})'
+        else:
+            root_elements = [root_element]
+            sheet_name = 'Syntax Tree'
+        data_provider = SyntaxTreeProvider(root_elements, self.view.id())
+        sublime.set_timeout(partial(self.show_tree, sheet_name, data_provider))
+
+    def reveal_caret(self, live_tree: LiveSyntaxTree) -> None:
+        root_element = live_tree.root_element
+        selection = self.view.sel()
+        if root_element is None or len(selection) == 0:
+            return
+        line, character = self.view.rowcol_utf16(selection[0].b)
+        element = root_element.tree.element_at(line, character)
+        revealed = element.ancestors if element else []
+        if live_tree.sheet is not None and revealed == live_tree.revealed:
             return
+        live_tree.revealed = revealed
+        data_provider = SyntaxTreeProvider([root_element], self.view.id(), revealed)
+        sublime.set_timeout(partial(self.show_tree, 'Syntax Tree (Live)', data_provider, live_tree))
+
+    def show_tree(
+        self, sheet_name: str, data_provider: SyntaxTreeProvider, live_tree: LiveSyntaxTree | None = None
+    ) -> None:
         window = self.view.window()
         if window is None:
             return
-        sheet_name = 'Syntax Tree'
-        root_element = parseSyntaxTree(out)
-        data_provider = SyntaxTreeProvider(root_element, self.view.id())
-        new_tree_view_sheet(window, sheet_name, data_provider, sheet_name, flags=sublime.NewFileFlags.ADD_TO_SELECTION)
+        flags = sublime.NewFileFlags.ADD_TO_SELECTION
+        if live_tree is not None and live_tree.sheet is not None:
+            # Replace the content of the existing sheet without changing the focus.
+            flags = sublime.NewFileFlags.NONE
+        sheet = new_tree_view_sheet(window, sheet_name, data_provider, sheet_name, flags=flags)
+        if live_tree is not None:
+            live_tree.sheet = sheet
+
+
+class RustAnalyzerLiveSyntaxTreeListener(sublime_plugin.EventListener):
+
+    def on_modified_async(self, view: sublime.View) -> None:
+        self.schedule_update(view)
+
+    def on_selection_modified_async(self, view: sublime.View) -> None:
+        self.schedule_update(view)
+
+    def on_close(self, view: sublime.View) -> None:
+        _live_trees.pop(view.id(), None)
+
+    def schedule_update(self, view: sublime.View) -> None:
+        live_tree = _live_trees.get(view.id())
+        if live_tree is None:
+            return
+        live_tree.generation += 1
+        sublime.set_timeout_async(partial(self.update, view, live_tree, live_tree.generation), LIVE_UPDATE_DELAY_MS)
+
+    def update(self, view: sublime.View, live_tree: LiveSyntaxTree, generation: int) -> None:
+        if live_tree.generation != generation:
+            return
+        if live_tree.is_closed() or not view.is_valid():
+            _live_trees.pop(view.id(), None)
+            return
+        view.run_command('rust_analyzer_syntax_tree', {'live': True})
 
 
 class RustAnalyzerSyntaxTreeClickNode(sublime_plugin.WindowCommand):
 
     def run(self, view_id: int, range: Range) -> None:
-        if view := self.find_view_id(view_id):
+        view = sublime.View(view_id)
+        if view.is_valid():
             view.run_command('rust_analyzer_syntax_tree_select_node_in_view', {'range': cast('dict[str, Any]', range)})
 
-    def find_view_id(self, view_id) -> sublime.View | None:
-        for view in self.window.views():
-            if view.id() == view_id:
-                return view
-        return None
-
 
 class RustAnalyzerSyntaxTreeSelectNodeInView(LspTextCommand):
 
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+import json
+import os
+import sublime
+
+LIVE_SETTINGS_FILE = '.live-settings.json'
+"""
+The file in the plugin storage with the server settings that are changed while the server runs.
+
+LSP restarts the server whenever the package settings or the project overrides change, which makes rust-analyzer
+index the workspace again. Settings changed with the `rust_analyzer_change_server_settings` command are instead sent
+to the running server with `workspace/didChangeConfiguration`, unless rust-analyzer only reads them on startup. They
+are stored per workspace folder in this file, so that later starts of the server use them too.
+"""
+
+RESTART_REQUIRED = ('files.', 'numThreads')
+"""
+Prefixes of the settings that rust-analyzer only reads when it starts: the file watcher is registered and the
+thread pool is created once.
+"""
+
+
+@lru_cache(maxsize=None)
+def server_defaults() -> dict[str, Any]:
+    """The default `initialization_options` of this package, which are the defaults of rust-analyzer."""
+    resource = f'Packages/{__package__}/LSP-rust-analyzer.sublime-settings'
+    return sublime.decode_value(sublime.load_resource(resource)).get('initialization_options', {})
+
+
+def non_default_settings(options: dict[str, Any], defaults: dict[str, Any], prefix: str = '') -> dict[str, Any]:
+    """The settings of the (nested) `options` that differ from the defaults, by their dotted keys."""
+    changed: dict[str, Any] = {}
+    for key, value in options.items():
+        dotted_key = f'{prefix}{key}'
+        if dotted_key not in defaults and isinstance(value, dict):
+            changed.update(non_default_settings(value, defaults, f'{dotted_key}.'))
+        elif dotted_key not in defaults or defaults[dotted_key] != value:
+            changed[dotted_key] = value
+    return changed
+
+
+def requires_restart(key: str) -> bool:
+    return key.startswith(RESTART_REQUIRED)
+
+
+def nest(settings: dict[str, Any]) -> dict[str, Any]:
+    """The settings with dotted keys as nested objects, as rust-analyzer expects them."""
+    nested: dict[str, Any] = {}
+    for key, value in settings.items():
+        *parents, name = key.split('.')
+        target = nested
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[name] = value
+    return nested
+
+
+def load_live_settings(storage_path: Path, folder: str) -> dict[str, Any]:
+    path = storage_path / LIVE_SETTINGS_FILE
+    if not path.is_file():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding='utf-8')).get(folder, {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_live_settings(storage_path: Path, folder: str, settings: dict[str, Any]) -> None:
+    """Store the live settings of the workspace folder, or forget them if `settings` is empty."""
+    path = storage_path / LIVE_SETTINGS_FILE
+    stored: dict[str, dict[str, Any]] = {}
+    if path.is_file():
+        try:
+            stored = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            pass
+    if settings:
+        stored[folder] = settings
+    else:
+        stored.pop(folder, None)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix('.tmp')
+    temporary.write_text(json.dumps(stored, indent=2), encoding='utf-8')
+    os.replace(temporary, path)
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+import json
+import re
+import time
+
+SNAPSHOT_SUFFIX = '.json'
+
+_UNITS = {'b': 1, 'kb': 1 << 10, 'mb': 1 << 20, 'gb': 1 << 30}
+
+# Lines look like `   123mb   4567 ParseQuery`, where older servers omit the entry count.
+_ROW_PATTERN = re.compile(r'^\s*(-?\d+(?:\.\d+)?)([kmg]?b)\s+(?:(\d+)\s+)?(\S.*?)\s*$', re.IGNORECASE)
+
+# The last line has the same format, but holds the memory that the allocator reports for the whole server.
+_TOTAL_ROW = 'Remaining'
+
+
+class QueryMemory(NamedTuple):
+    query: str
+    size: int
+    """In bytes, as far as the (rounded) server output allows."""
+    entries: Optional[int]
+
+
+class MemoryUsage(NamedTuple):
+    rows: List[QueryMemory]
+    total: Optional[int]
+    """The memory allocated by the server, if it reported it."""
+
+
+class MemoryDiff(NamedTuple):
+    query: str
+    before: int
+    after: int
+
+    @property
+    def growth(self) -> int:
+        return self.after - self.before
+
+
+def parse_memory_usage(payload: str) -> MemoryUsage:
+    """Parse the `rust-analyzer/memoryUsage` response into rows sorted by size, largest first, and the total."""
+    rows: list[QueryMemory] = []
+    for line in payload.splitlines():
+        if match := _ROW_PATTERN.match(line):
+            value, unit, entries, query = match.groups()
+            rows.append(QueryMemory(
+                query=query,
+                size=int(float(value) * _UNITS[unit.lower()]),
+                entries=int(entries) if entries is not None else None,
+            ))
+    rows.sort(key=lambda row: row.size, reverse=True)
+    return _split_total(rows)
+
+
+def _split_total(rows: list[QueryMemory]) -> MemoryUsage:
+    total = next((row.size for row in rows if row.query == _TOTAL_ROW), None)
+    return MemoryUsage([row for row in rows if row.query != _TOTAL_ROW], total)
+
+
+def format_size(size: int) -> str:
+    for unit, factor in (('GiB', 1 << 30), ('MiB', 1 << 20), ('KiB', 1 << 10)):
+        if abs(size) >= factor:
+            return f'{size / factor:.1f} {unit}'
+    return f'{size} B'
+
+
+def format_report(usage: MemoryUsage) -> str:
+    total = sum(row.size for row in usage.rows)
+    lines = [f'{"Size":>12} {"Share":>6} {"Entries":>9}  Query']
+    for row in usage.rows:
+        share = 100 * row.size / total if total else 0
+        entries = '' if row.entries is None else str(row.entries)
+        lines.append(f'{format_size(row.size):>12} {share:>5.1f}% {entries:>9}  {row.query}')
+    lines.append(f'{format_size(total):>12} {"":>6} {"":>9}  Total of the queries')
+    if usage.total is not None:
+        lines.append(f'{format_size(usage.total):>12} {"":>6} {"":>9}  Allocated by the server')
+    return '\n'.join(lines) + '\n'
+
+
+def save_snapshot(directory: Path, usage: MemoryUsage, workspace: str | None) -> Path:
+    """Store `usage` in a new snapshot file named after the current time, down to the microsecond."""
+    directory.mkdir(parents=True, exist_ok=True)
+    now = time.time()
+    stem = f'{time.strftime("%Y%m%d-%H%M%S", time.localtime(now))}-{int(now % 1 * 1_000_000):06d}'
+    content = json.dumps({'workspace': workspace, 'rows': [list(row) for row in usage.rows], 'total': usage.total})
+    path = directory / f'{stem}{SNAPSHOT_SUFFIX}'
+    attempt = 0
+    while True:
+        try:
+            # Never overwrite another snapshot, also not one that another window takes at the same time.
+            with open(path, 'x', encoding='utf-8') as f:
+                f.write(content)
+            return path
+        except FileExistsError:
+            attempt += 1
+            path = directory / f'{stem}-{attempt}{SNAPSHOT_SUFFIX}'
+
+
+def load_snapshot(path: Path) -> MemoryUsage:
+    content = json.loads(path.read_text(encoding='utf-8'))
+    # Older snapshots have the total among the rows.
+    usage = _split_total([QueryMemory(*row) for row in content['rows']])
+    return usage._replace(total=content['total']) if 'total' in content else usage
+
+
+def snapshot_workspace(path: Path) -> str | None:
+    try:
+        return json.loads(path.read_text(encoding='utf-8')).get('workspace')
+    except (OSError, ValueError):
+        return None
+
+
+def list_snapshots(directory: Path) -> List[Path]:
+    """The snapshots in `directory`, newest first."""
+    if not directory.is_dir():
+        return []
+    return sorted(directory.glob(f'*{SNAPSHOT_SUFFIX}'), reverse=True)
+
+
+def diff_snapshots(before: list[QueryMemory], after: list[QueryMemory]) -> list[MemoryDiff]:
+    """Compare two snapshots by query, sorted by the growth of each query, largest first."""
+    sizes_before = {row.query: row.size for row in before}
+    sizes_after = {row.query: row.size for row in after}
+    diffs = [
+        MemoryDiff(query, sizes_before.get(query, 0), sizes_after.get(query, 0))
+        for query in dict.fromkeys([*sizes_after, *sizes_before])
+    ]
+    diffs.sort(key=lambda diff: diff.growth, reverse=True)
+    return diffs
+
+
+def format_diff(diffs: list[MemoryDiff]) -> str:
+    lines = [f'{"Growth":>12} {"Before":>12} {"After":>12}  Query']
+    for diff in diffs:
+        lines.append(_diff_line(diff.query, diff.before, diff.after))
+    lines.append(_diff_line('Total', sum(diff.before for diff in diffs), sum(diff.after for diff in diffs)))
+    return '\n'.join(lines) + '\n'
+
+
+def _diff_line(query: str, before: int, after: int) -> str:
+    growth = ('+' if after > before else '') + format_size(after - before)
+    return f'{growth:>12} {format_size(before):>12} {format_size(after):>12}  {query}'
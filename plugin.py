@@ -1,38 +1,106 @@
 from __future__ import annotations
 
+from .command_expand_macros import clear_expansion_cache
+from .command_server_monitor import is_supported as is_server_monitor_supported
+from .command_server_monitor import server_monitor
+from .live_settings import LIVE_SETTINGS_FILE
+from .live_settings import load_live_settings
+from .live_settings import nest
+from .live_settings import non_default_settings
+from .live_settings import requires_restart
+from .live_settings import save_live_settings
+from .live_settings import server_defaults
+from .memory_report import diff_snapshots
+from .memory_report import format_diff
+from .memory_report import format_report
+from .memory_report import list_snapshots
+from .memory_report import load_snapshot
+from .memory_report import parse_memory_usage
+from .memory_report import save_snapshot
+from .memory_report import snapshot_workspace
+from .request_gate import on_server_status
+from .request_gate import reset_gate
+from .request_gate import send_request_when_quiescent
+from .server_discovery import discover_server
+from .server_installer import download_file
+from .server_installer import extract_gzip
+from .server_installer import extract_zip_member
+from .server_installer import is_valid_cache_entry
+from .server_installer import local_path
+from .server_installer import published_checksum
+from .server_installer import read_checksum
+from .server_installer import sha256_of
+from .server_installer import status_bar_progress
+from .server_installer import store_in_cache
+from .server_installer import verify_checksum
+from .server_prewarm import is_prewarmed
+from .server_prewarm import RECENT_WORKSPACES_FILE
+from .server_prewarm import remember_workspace
+from .server_prewarm import start_prewarming
+from .server_sharing import cargo_workspace_root
+from .server_sharing import shared_server_port
+from .server_sharing import shared_session_count
+from .server_sharing import TOKEN_OPTION as SHARING_TOKEN_OPTION
+from .server_tuning import available_memory
+from .server_tuning import describe
+from .server_tuning import Machine
+from .server_tuning import physical_core_count
+from .server_tuning import tune
+from .server_tuning import TUNED_DEFAULTS
+from .server_tuning import workspace_size
+from .session_hibernation import CONFIG_NAME
+from .session_hibernation import is_waking
+from .startup_timeline import format_timelines
+from .startup_timeline import load_timelines
+from .startup_timeline import save_timeline
+from .startup_timeline import Timeline
+from collections import OrderedDict
 from functools import partial
 from LSP.plugin import ClientConfig
 from LSP.plugin import ClientRequest
 from LSP.plugin import command_handler
+from LSP.plugin import DottedDict
 from LSP.plugin import LspPlugin
 from LSP.plugin import LspTextCommand
+from LSP.plugin import LspWindowCommand
+from LSP.plugin import Notification
 from LSP.plugin import OnPreStartContext
 from LSP.plugin import Promise
 from LSP.plugin import Request
+from LSP.plugin import ServerNotification
 from LSP.plugin import ServerResponse
 from LSP.plugin.core.protocol import Point
 from LSP.plugin.core.views import first_selection_region
 from LSP.plugin.core.views import point_to_offset
 from LSP.plugin.core.views import region_to_range
 from LSP.plugin.core.views import text_document_position_params
-from LSP.protocol import AnnotatedTextEdit
 from LSP.protocol import InsertTextFormat
 from LSP.protocol import LSPAny
+from LSP.protocol import NotRequired
 from LSP.protocol import SnippetTextEdit
-from LSP.protocol import TextEdit
+from operator import methodcaller
+from pathlib import Path
 from typing import Any
 from typing import cast
+from typing import Generic
+from typing import Tuple
 from typing import TYPE_CHECKING
 from typing import TypedDict
+from typing import TypeVar
 from typing_extensions import override
-import gzip
+import json
+import os
 import shutil
 import sublime
-import urllib.request
-import zipfile
+import sublime_plugin
+import tempfile
+import threading
+import time
 
 if TYPE_CHECKING:
     from LSP.protocol import Location
+    from LSP.protocol import LocationLink
+    from LSP.protocol import TextDocumentPositionParams
 
 
 try:
@@ -55,6 +123,46 @@ package.json, but not in `LSP-rust-analyzer`'s sublime-settings.
 
 URL = "https://github.com/rust-analyzer/rust-analyzer/releases/download/{tag}/rust-analyzer-{arch}-{platform}.{ext}"
 
+TAG_CHECKSUMS: dict[str, str] = {}
+"""
+The sha256 digests of the release archives of `TAG` by archive name, so that installing from `URL` doesn't depend on
+the (rate limited) GitHub API. Update them together with `TAG`, from the `digest` of each asset listed by
+https://api.github.com/repos/rust-lang/rust-analyzer/releases/tags/<TAG>.
+"""
+
+DOWNLOADS_DIR = ".downloads"
+"""Directory within the plugin storage that holds (partially) downloaded release archives."""
+MEMORY_SNAPSHOTS_DIR = ".memory-snapshots"
+TIMELINES_DIR = ".timelines"
+PRESERVED_STORAGE = {DOWNLOADS_DIR, MEMORY_SNAPSHOTS_DIR, TIMELINES_DIR, RECENT_WORKSPACES_FILE, LIVE_SETTINGS_FILE}
+"""Entries of the plugin storage that aren't server installs."""
+
+_install_lock = threading.Lock()
+
+RUNNABLES_CACHE_SIZE = 32
+"""The number of `experimental/runnables` results kept around."""
+
+EXTERNAL_DOCS_CACHE_SIZE = 64
+"""The number of `experimental/externalDocs` results kept around."""
+
+RUNNABLES_PREFETCH_DELAY_MS = 500
+"""Time that the caret must rest in a Rust file before the runnables at its position are prefetched."""
+
+RESOLVE_CHUNK_SIZE = 256
+"""The document changes of a code action that are converted before yielding to other threads."""
+
+SLOW_RESOLVE_MS = 50
+"""Converting the snippets of a resolved code action that takes longer than this is logged to the console."""
+
+_insert_text_format = methodcaller('get', 'insertTextFormat')
+"""Get the `insertTextFormat` of a text edit, without a Python frame per call."""
+
+
+class InstallOptions(TypedDict, total=True):
+    background_update: bool
+    download_url: str
+    cache_dir: Path | None
+
 
 class RunnableArgs(TypedDict, total=True):
     cargoArgs: list[str]
@@ -67,6 +175,69 @@ class Runnable(TypedDict, total=True):
     args: RunnableArgs
     kind: str
     label: str
+    location: NotRequired[LocationLink]
+
+
+K = TypeVar('K', bound=Tuple[Any, ...])
+V = TypeVar('V')
+
+
+class DocumentResultCache(Generic[K, V]):
+    """
+    A least recently used cache of request results, by keys that start with the document URI and its change count.
+
+    Storing the result for a version of a document drops those of its earlier versions, which can't be looked up
+    anymore. A late result for an earlier version than one already stored is ignored.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self._max_size = max_size
+        self._entries: OrderedDict[K, V] = OrderedDict()
+
+    def get(self, key: K) -> V | None:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        same_document = [k for k in self._entries if k[0] == key[0]]
+        if any(k[1] > key[1] for k in same_document):
+            return
+        for stale in same_document:
+            if stale[1] < key[1]:
+                del self._entries[stale]
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+# The document URI, its change count and the line of the caret.
+RunnablesCacheKey = Tuple[str, int, int]
+
+
+def runnables_cache_key(view: sublime.View, params: TextDocumentPositionParams) -> RunnablesCacheKey:
+    # The runnables depend on the item at the caret, which can only change when the caret changes lines.
+    return (params['textDocument']['uri'], view.change_count(), params['position']['line'])
+
+
+runnables_cache: DocumentResultCache[RunnablesCacheKey, list[Runnable]] = DocumentResultCache(RUNNABLES_CACHE_SIZE)
+
+
+# The document URI, its change count and the position of the caret.
+ExternalDocsCacheKey = Tuple[str, int, int, int]
+
+
+def external_docs_cache_key(view: sublime.View, params: TextDocumentPositionParams) -> ExternalDocsCacheKey:
+    position = params['position']
+    return (params['textDocument']['uri'], view.change_count(), position['line'], position['character'])
+
+
+external_docs_cache: DocumentResultCache[ExternalDocsCacheKey, str] = DocumentResultCache(EXTERNAL_DOCS_CACHE_SIZE)
 
 
 def arch() -> str:
@@ -89,6 +260,19 @@ def platform() -> str:
     return "unknown-linux-gnu"
 
 
+def server_filename() -> str:
+    return "rust-analyzer.exe" if sublime.platform() == "windows" else "rust-analyzer"
+
+
+def runnable_command(runnable: Runnable) -> list[str]:
+    args = runnable["args"]
+    cargo_path = args.get("overrideCargo") or 'cargo'
+    command_to_run = [cargo_path, *args.get("cargoArgs", [])]
+    if args.get("executableArgs"):
+        command_to_run += ['--'] + args["executableArgs"]
+    return command_to_run
+
+
 def open_runnables_in_terminus(window: sublime.Window, runnables: list[Runnable], config: ClientConfig) -> None:
     filtered_runnables = [r for r in runnables if r["kind"] == "cargo"]
     if len(filtered_runnables) == 0:
@@ -102,14 +286,11 @@ def open_runnables_in_terminus(window: sublime.Window, runnables: list[Runnable]
         return
     for runnable in filtered_runnables:
         args = runnable["args"]
-        cargo_path = args.get("overrideCargo") or 'cargo'
-        command_to_run = [cargo_path, *args.get("cargoArgs", [])]
+        command_to_run = runnable_command(runnable)
         if not shutil.which(command_to_run[0]):
             sublime.error_message(
                 f'Cannot run executable "{command_to_run[0]}". Ensure that it is in the PATH of the Sublime Text process.')
             return
-        if args.get("executableArgs"):
-            command_to_run += ['--'] + args["executableArgs"]
         terminus_args = {
             "title": runnable["label"],
             "cmd": command_to_run,
@@ -127,50 +308,276 @@ def get_package_setting(config: ClientConfig, key: str, *, default: Any = None)
         return config.settings.get(legacy_key, default)
     return config.initialization_options.get(key, default)
 
+
+_pending_timelines: dict[tuple[int, str], Timeline] = {}
+"""
+The startup timelines of the sessions that are being started, by the id of their window and the name of their
+configuration. A timeline is only added once the start was prepared, and the next start in the window replaces it.
+"""
+
+
 class RustAnalyzer(LspPlugin):
 
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._created = time.monotonic()
+        self._timeline: Timeline | None = None
+        self._timeline_attached = False
+        # The window whose requests the server status gates, kept for when the session is gone.
+        self._gated_window: sublime.Window | None = None
+
     @classmethod
     @override
     def on_pre_start_async(cls, context: OnPreStartContext) -> None:
+        timeline = None
+        if context.workspace_folders:
+            workspace = context.workspace_folders[0].path
+            timeline = Timeline(workspace)
+            timeline.mark('pre start')
         server_path = context.configuration.root_settings.get('server_path')
         if not server_path or server_path == 'auto':
-            cls.install_server()
-            server_path = str(cls.plugin_storage_path / 'rust-analyzer')
+            server_path = str(cls.auto_server_path(context))
+        if timeline:
+            timeline.mark('server resolved')
         context.variables.update({'server_path': server_path})
+        root_settings = context.configuration.root_settings
+        sharing_token = None
+        if context.workspace_folders:
+            root = cargo_workspace_root(context.workspace_folders[0].path)
+            # Pre-warmed servers are shared servers that the session of the window takes over.
+            prewarm_count = root_settings.get('prewarm_workspaces')
+            if root_settings.get('server_sharing') or (prewarm_count and is_prewarmed(root, prewarm_count)):
+                sharing_token = cls.share_server(context, root)
+            elif prewarm_count:
+                # Remember the workspace, so that its server is shared and pre-warmed from its next start on.
+                command = sublime.expand_variables(context.configuration.command, context.variables)
+                remember_workspace(root, command, context.configuration.env)
+        if (interval := root_settings.get('server_monitor_interval')) and is_server_monitor_supported():
+            server_monitor.start(interval, root_settings.get('server_monitor_rss_alert_mib'), from_setting=True)
+        if root_settings.get('performance_profile') == 'auto' and context.workspace_folders:
+            cls.auto_tune(context)
+        if is_waking([folder.path for folder in context.workspace_folders]):
+            # The window was idle, so prime the caches before the user asks for anything.
+            context.configuration.initialization_options.set('cachePriming.enable', True)
         # Copy initialization_options to settings.
         legacy_settings = context.configuration.settings.get('rust-analyzer') or {}
         context.configuration.initialization_options.update(legacy_settings)
+        if context.workspace_folders:
+            live_settings = load_live_settings(cls.plugin_storage_path, context.workspace_folders[0].path)
+            for key, value in live_settings.items():
+                context.configuration.initialization_options.set(key, value)
+        # The server falls back to its defaults for missing settings, so only send the ones that differ.
+        context.configuration.initialization_options = DottedDict(
+            non_default_settings(context.configuration.initialization_options.get(), server_defaults()))
         context.configuration.settings.set('rust-analyzer', context.configuration.initialization_options.get())
+        if sharing_token:
+            # Only sent with `initialize`, where the multiplexer takes it out again.
+            context.configuration.initialization_options.set(SHARING_TOKEN_OPTION, sharing_token)
+        if timeline:
+            _pending_timelines[(context.window.id(), context.configuration.name)] = timeline
 
     @classmethod
-    def install_server(cls) -> None:
-        version_file_path = cls.plugin_storage_path / "VERSION"
-        if version_file_path.is_file() and version_file_path.read_text(encoding="utf-8") == TAG:
-            return
+    def auto_tune(cls, context: OnPreStartContext) -> None:
+        """Pick thread counts and cache sizes for this machine and workspace, unless the user configured them."""
+        configuration = context.configuration
+        machine = Machine(physical_core_count(), available_memory())
+        workspace = workspace_size(cargo_workspace_root(context.workspace_folders[0].path))
+        chosen = {
+            key: value for key, value in tune(machine, workspace).items()
+            if get_package_setting(configuration, key, default=TUNED_DEFAULTS[key]) == TUNED_DEFAULTS[key]
+        }
+        for key, value in chosen.items():
+            configuration.initialization_options.set(key, value)
+        if chosen:
+            values = ', '.join(f'"{key}": {json.dumps(value)}' for key, value in chosen.items())
+            print(f'LSP-rust-analyzer: tuned for {describe(machine, workspace)}: {values}. '
+                  'Set these in "initialization_options" to override them.')
+
+    @classmethod
+    def share_server(cls, context: OnPreStartContext, root: str) -> str:
+        """
+        Connect to the server of another window on the same Cargo workspace, or start one that others can join.
+        Return the token that the session has to send to be let in.
+        """
+        configuration = context.configuration
+        command = sublime.expand_variables(configuration.command, context.variables)
+        remember_workspace(root, command, configuration.env)
+        on_initialize = partial(remember_workspace, root, command, configuration.env)
+        port, token = shared_server_port(root, command, configuration.env, on_initialize)
+        # Without a command, LSP connects to the server on the given port instead of starting one.
+        configuration.command = []
+        configuration.tcp_port = port
+        return token
+
+    @classmethod
+    def auto_server_path(cls, context: OnPreStartContext) -> Path:
+        root_settings = context.configuration.root_settings
+        if root_settings.get('server_discovery'):
+            workspace_root = context.workspace_folders[0].path if context.workspace_folders else None
+            if discovered := discover_server(workspace_root):
+                server_path, version = discovered
+                print(f'LSP-rust-analyzer: using {version} from {server_path}')
+                return Path(server_path)
+        cache_dir = root_settings.get('server_cache_dir')
+        options: InstallOptions = {
+            'background_update': bool(root_settings.get('server_background_update')),
+            'download_url': root_settings.get('server_download_url') or URL,
+            'cache_dir': Path(os.path.expanduser(cache_dir)) if cache_dir else None,
+        }
+        return cls.resolve_server(options)
+
+    @classmethod
+    def resolve_server(cls, options: InstallOptions) -> Path:
+        """
+        Return the path of the server binary to start, installing it first if needed.
+
+        With the `background_update` option the most recent previously installed version is returned right away
+        when the current `TAG` is not installed yet. The current version is then downloaded in the background and
+        used from the next start on.
+        """
+        current = cls.server_binary_path(TAG)
+        if current.is_file():
+            cls.remove_stale_installs(keep={TAG})
+            return current
+        previous = next(iter(cls.installed_tags()), None)
+        if options['background_update'] and previous is not None:
+            cls.remove_stale_installs(keep={TAG, previous})
+            threading.Thread(target=partial(cls.install_server_in_background, options), daemon=True).start()
+            return cls.server_binary_path(previous)
+        cls.install_server(options)
+        cls.remove_stale_installs(keep={TAG})
+        return current
+
+    @classmethod
+    def server_binary_path(cls, tag: str) -> Path:
+        return cls.plugin_storage_path / tag / server_filename()
+
+    @classmethod
+    def installed_tags(cls) -> list[str]:
+        """The tags of all complete installs, newest first."""
+        if not cls.plugin_storage_path.is_dir():
+            return []
+        tags = [
+            path.name for path in cls.plugin_storage_path.iterdir()
+            if not path.name.startswith('.') and (path / server_filename()).is_file()
+        ]
+        return sorted(tags, reverse=True)
+
+    @classmethod
+    def install_server_in_background(cls, options: InstallOptions) -> None:
         try:
-            if cls.plugin_storage_path.is_dir():
-                shutil.rmtree(cls.plugin_storage_path)
-            cls.plugin_storage_path.mkdir(exist_ok=True, parents=True)
+            cls.install_server(options)
+        except Exception as ex:
+            print(f'LSP-rust-analyzer: failed to update the server to {TAG} in the background: {ex}')
+        else:
+            sublime.status_message(f'rust-analyzer {TAG} installed. It will be used after the server restarts.')
+
+    @classmethod
+    def install_server(cls, options: InstallOptions) -> None:
+        """
+        Install the server binary of the current `TAG` into `<storage>/<TAG>/`.
+
+        The release archive is taken from the shared cache directory when it holds a verified copy. Otherwise it
+        is fetched from the download URL, which can also be a `file://` URL or a local mirror directory, and then
+        added to the cache.
+
+        The binary is unpacked into a temporary directory first which is then renamed into place, so an
+        install directory either holds a complete binary or doesn't exist.
+        """
+        with _install_lock:
+            if cls.server_binary_path(TAG).is_file():
+                return
             is_windows = sublime.platform() == "windows"
             extension = "zip" if is_windows else "gz"
-            url = URL.format(tag=TAG, arch=arch(), platform=platform(), ext=extension)
-            archive_file = cls.plugin_storage_path / f"rust-analyzer.{extension}"
-            rust_analyzer_filename = "rust-analyzer.exe" if is_windows else "rust-analyzer"
-            rust_analyzer_path = cls.plugin_storage_path / rust_analyzer_filename
-            with urllib.request.urlopen(url) as fp, open(archive_file, "wb") as f:
-                f.write(fp.read())
-            if is_windows:
-                with zipfile.ZipFile(archive_file, "r") as zip_ref:
-                    zip_ref.extract(rust_analyzer_filename, cls.plugin_storage_path)
+            archive_name = f"rust-analyzer-{arch()}-{platform()}.{extension}"
+            cache_dir = options['cache_dir']
+            cached_file = cache_dir / TAG / archive_name if cache_dir else None
+            downloaded_file: Path | None = None
+            if cached_file and is_valid_cache_entry(cached_file):
+                archive_file = cached_file
             else:
-                with gzip.open(archive_file, "rb") as fp, open(rust_analyzer_path, "wb") as f:
-                    f.write(fp.read())
-            archive_file.unlink()
-            rust_analyzer_path.chmod(0o744)
-            version_file_path.write_text(TAG, encoding='utf-8')
-        except BaseException:
-            shutil.rmtree(cls.plugin_storage_path, ignore_errors=True)
-            raise
+                url = options['download_url'].format(tag=TAG, arch=arch(), platform=platform(), ext=extension)
+                mirror_path = local_path(url)
+                if mirror_path is not None:
+                    archive_file = mirror_path / TAG / archive_name if mirror_path.is_dir() else mirror_path
+                    checksum = read_checksum(archive_file)
+                else:
+                    # Looked up first, so that nothing is downloaded when there is no checksum to verify against.
+                    is_default_url = options['download_url'] == URL
+                    checksum = TAG_CHECKSUMS.get(archive_name) if is_default_url else None
+                    if checksum is None:
+                        try:
+                            checksum = published_checksum(url)
+                        except (OSError, ValueError) as ex:
+                            if not is_default_url:
+                                raise
+                            print(f"LSP-rust-analyzer: failed to look up the checksum of {url}: {ex}")
+                    if checksum is None and not is_default_url:
+                        raise ValueError(f"No sha256 checksum is published for {url}, so it cannot be verified")
+                    downloads_dir = cls.plugin_storage_path / DOWNLOADS_DIR
+                    downloads_dir.mkdir(exist_ok=True, parents=True)
+                    # A partial download is kept around so that an interrupted download can be resumed.
+                    archive_file = downloaded_file = downloads_dir / f"rust-analyzer-{TAG}.{extension}"
+                    download_file(url, archive_file, status_bar_progress(f"Downloading rust-analyzer {TAG}"))
+                try:
+                    if checksum is None and downloaded_file:
+                        # Only the default URL gets here, which is downloaded from GitHub over HTTPS.
+                        print(f"LSP-rust-analyzer: {archive_name} of {TAG} was downloaded without a checksum to "
+                              "verify it against")
+                        checksum = sha256_of(archive_file)
+                    else:
+                        verify_checksum(archive_file, checksum)
+                except ValueError:
+                    if downloaded_file:
+                        # Resuming a corrupt download would fail again.
+                        downloaded_file.unlink(missing_ok=True)
+                    raise
+                if cached_file and checksum:
+                    try:
+                        store_in_cache(archive_file, cached_file, checksum)
+                    except OSError as ex:
+                        print(f'LSP-rust-analyzer: failed to store the server archive in the cache: {ex}')
+            cls.plugin_storage_path.mkdir(exist_ok=True, parents=True)
+            staging_dir = Path(tempfile.mkdtemp(prefix=f".{TAG}-", dir=str(cls.plugin_storage_path)))
+            try:
+                rust_analyzer_filename = server_filename()
+                if is_windows:
+                    extract_zip_member(archive_file, rust_analyzer_filename, staging_dir)
+                else:
+                    extract_gzip(archive_file, staging_dir / rust_analyzer_filename)
+                (staging_dir / rust_analyzer_filename).chmod(0o744)
+                install_dir = cls.plugin_storage_path / TAG
+                if install_dir.is_dir():
+                    # Left over from an install that was interrupted before this layout was used.
+                    shutil.rmtree(install_dir)
+                staging_dir.replace(install_dir)
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            if downloaded_file:
+                downloaded_file.unlink()
+
+    @classmethod
+    def remove_stale_installs(cls, *, keep: set[str]) -> None:
+        """Remove installs of other tags, leftover staging directories and files of the pre-versioned layout."""
+        if not cls.plugin_storage_path.is_dir() or not _install_lock.acquire(blocking=False):
+            return
+        try:
+            for path in cls.plugin_storage_path.iterdir():
+                if path.name in keep or path.name in PRESERVED_STORAGE:
+                    continue
+                if path.is_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    path.unlink()
+            downloads_dir = cls.plugin_storage_path / DOWNLOADS_DIR
+            if downloads_dir.is_dir():
+                for path in downloads_dir.iterdir():
+                    if not path.name.startswith(f"rust-analyzer-{TAG}."):
+                        path.unlink()
+        except OSError as ex:
+            print(f'LSP-rust-analyzer: failed to remove stale server installs: {ex}')
+        finally:
+            _install_lock.release()
 
     @override
     def on_pre_send_request_async(self, request: ClientRequest, view: sublime.View | None) -> None:
@@ -186,22 +593,74 @@ class RustAnalyzer(LspPlugin):
                     params['position'] = region_to_range(view, region)  # pyright: ignore[reportGeneralTypeIssues]
             return
 
+    @override
+    def on_server_notification_async(self, notification: ServerNotification) -> None:
+        if notification['method'] == 'experimental/serverStatus' and (session := self.weaksession()):
+            self._gated_window = session.window
+            on_server_status(session.window, notification['params'])
+        if (timeline := self.startup_timeline()) is None:
+            return
+        method = notification['method']
+        if method == '$/progress':
+            timeline.on_progress(notification['params'])
+        elif method == 'experimental/serverStatus' and notification['params'].get('quiescent'):
+            timeline.mark('quiescent')
+            self.save_startup_timeline()
+
+    @override
+    def on_session_end_async(self, exit_code: int | None, exception: Exception | None) -> None:
+        if self._gated_window:
+            reset_gate(self._gated_window)
+        # Also keep the timeline of a server that never became quiescent, it shows where the start got stuck.
+        if timeline := self.startup_timeline():
+            timeline.mark('session ended')
+            self.save_startup_timeline()
+
+    def startup_timeline(self) -> Timeline | None:
+        """The timeline of this session until the server is quiescent for the first time."""
+        if not self._timeline_attached:
+            self._timeline_attached = True
+            if session := self.weaksession():
+                self._timeline = _pending_timelines.pop((session.window.id(), session.config.name), None)
+                if self._timeline:
+                    self._timeline.mark('session created', at=self._created)
+        return self._timeline
+
+    def save_startup_timeline(self) -> None:
+        if timeline := self._timeline:
+            self._timeline = None
+            save_timeline(self.plugin_storage_path / TIMELINES_DIR, timeline)
+
     @override
     def on_server_response_async(self, response: ServerResponse) -> None:
+        if response['method'] == 'initialize':
+            if timeline := self.startup_timeline():
+                timeline.mark('initialized')
+            return
         if response['method'] == 'codeAction/resolve':
             result = response['result']
             if (edit := result.get('edit')) and (document_changes := edit.get('documentChanges')):
-                for change in document_changes:
-                    if 'edits' in change:
-                        for edit in change['edits']:
-                            if 'newText' in edit:
-                                self.convert_proprietary_snippet(edit)
+                self.convert_proprietary_snippets(document_changes)
             return
 
-    def convert_proprietary_snippet(self, edit: TextEdit | AnnotatedTextEdit) -> None:
-        if edit.get('insertTextFormat') == InsertTextFormat.Snippet:
-            cast('SnippetTextEdit', edit)['snippet'] = {'kind': 'snippet', 'value': edit['newText']}
-
+    def convert_proprietary_snippets(self, document_changes: list[Any]) -> None:
+        start = time.perf_counter()
+        snippet_format = InsertTextFormat.Snippet
+        snippets = 0
+        for index, change in enumerate(document_changes, 1):
+            # Most assists don't produce snippets, so first look for one without leaving C code.
+            if (edits := change.get('edits')) and snippet_format in map(_insert_text_format, edits):
+                for edit in edits:
+                    if edit.get('insertTextFormat') == snippet_format and 'newText' in edit:
+                        cast('SnippetTextEdit', edit)['snippet'] = {'kind': 'snippet', 'value': edit['newText']}
+                        snippets += 1
+            if index % RESOLVE_CHUNK_SIZE == 0:
+                # Let the UI thread run in between chunks of a huge workspace edit.
+                time.sleep(0)
+        milliseconds = (time.perf_counter() - start) * 1000
+        if milliseconds > SLOW_RESOLVE_MS:
+            print(f'LSP-rust-analyzer: converting the snippets of a code action in {len(document_changes)} documents '
+                  f'took {milliseconds:.0f} ms ({snippets} snippets)')
 
     @command_handler('rust-analyzer.runSingle')
     @command_handler('rust-analyzer.runDebug')
@@ -242,38 +701,54 @@ class RustAnalyzerOpenDocsCommand(LspTextCommand):
         if session is None:
             return
         params = text_document_position_params(self.view, self.view.sel()[0].b)
-        session.send_request(Request("experimental/externalDocs", params), self.on_result_async)
-
-    def on_result_async(self, url: str | None) -> None:
-        window = self.view.window()
-        if window is None:
+        key = external_docs_cache_key(self.view, params)
+        if (url := external_docs_cache.get(key)) is not None:
+            self.open_url(url)
             return
+        session.send_request(Request("experimental/externalDocs", params), partial(self.on_result_async, key))
+
+    def on_result_async(self, key: ExternalDocsCacheKey, url: str | None) -> None:
         if url is not None:
+            external_docs_cache.put(key, url)
+            self.open_url(url)
+
+    def open_url(self, url: str) -> None:
+        window = self.view.window()
+        if window is not None:
             window.run_command("open_url", {"url": url})
 
 
 class RustAnalyzerMemoryUsage(LspTextCommand):
 
-    def run(self, edit: sublime.Edit) -> None:
+    def run(self, edit: sublime.Edit, save_snapshot: bool = False) -> None:
         session = self.session_by_name(self.session_name)
         if session is None:
             return
         session.send_request(
             Request("rust-analyzer/memoryUsage"),
-            lambda response: sublime.set_timeout(partial(self.on_result, response))
+            lambda response: sublime.set_timeout(partial(self.on_result, response, save_snapshot))
         )
 
-    def on_result(self, payload: str) -> None:
+    def on_result(self, payload: str, save: bool = False) -> None:
         window = self.view.window()
         if window is None:
             return
+        usage = parse_memory_usage(payload)
+        snapshot = None
+        if usage.rows and save:
+            folders = window.folders()
+            snapshot = save_snapshot(
+                RustAnalyzer.plugin_storage_path / MEMORY_SNAPSHOTS_DIR, usage, folders[0] if folders else None)
         sheets = window.selected_sheets()
         view = window.new_file(flags=sublime.TRANSIENT)
         view.set_scratch(True)
         view.set_name("--- RustAnalyzer Memory Usage ---")
         view.run_command("append", {"characters": "Per-query memory usage:\n"})
-        view.run_command("append", {"characters": payload})
+        # Fall back to the raw text if the server changed its output format.
+        view.run_command("append", {"characters": format_report(usage) if usage.rows else payload})
         view.run_command("append", {"characters": "\n(note: database has been cleared)"})
+        if snapshot is not None:
+            view.run_command("append", {"characters": f"\n(saved as snapshot {snapshot.stem})"})
         view.set_read_only(True)
         sheet = view.sheet()
         if sheet is not None:
@@ -281,6 +756,201 @@ class RustAnalyzerMemoryUsage(LspTextCommand):
             window.select_sheets(sheets)
 
 
+class MemorySnapshotInputHandler(sublime_plugin.ListInputHandler):
+
+    def __init__(self, name: str, snapshots: list[Path]) -> None:
+        self._name = name
+        self.snapshots = snapshots
+
+    def name(self) -> str:
+        return self._name
+
+    def placeholder(self) -> str:
+        return "Older snapshot" if self._name == "before" else "Newer snapshot"
+
+    def list_items(self) -> list[sublime.ListInputItem]:
+        return [
+            sublime.ListInputItem(path.stem, str(path), annotation=os.path.basename(snapshot_workspace(path) or ""))
+            for path in self.snapshots
+        ]
+
+    def next_input(self, args: dict[str, Any]) -> sublime_plugin.ListInputHandler | None:
+        if self._name == "before" and "after" not in args:
+            return MemorySnapshotInputHandler("after", self.snapshots)
+        return None
+
+
+class RustAnalyzerMemoryUsageDiff(sublime_plugin.WindowCommand):
+    """Show how much memory each query gained or lost between two memory usage snapshots."""
+
+    def is_enabled(self) -> bool:
+        return len(list_snapshots(RustAnalyzer.plugin_storage_path / MEMORY_SNAPSHOTS_DIR)) >= 2
+
+    def input(self, args: dict[str, Any]) -> sublime_plugin.ListInputHandler | None:
+        snapshots = list_snapshots(RustAnalyzer.plugin_storage_path / MEMORY_SNAPSHOTS_DIR)
+        if "before" not in args:
+            return MemorySnapshotInputHandler("before", snapshots)
+        if "after" not in args:
+            return MemorySnapshotInputHandler("after", snapshots)
+        return None
+
+    def run(self, before: str, after: str) -> None:
+        try:
+            diffs = diff_snapshots(load_snapshot(Path(before)).rows, load_snapshot(Path(after)).rows)
+        except (OSError, ValueError, KeyError, TypeError) as ex:
+            sublime.error_message(f"LSP-rust-analyzer: cannot read the memory usage snapshot: {ex}")
+            return
+        view = self.window.new_file(flags=sublime.TRANSIENT)
+        view.set_scratch(True)
+        view.set_name("--- RustAnalyzer Memory Usage Diff ---")
+        title = f"Per-query memory usage from {Path(before).stem} to {Path(after).stem}:\n"
+        view.run_command("append", {"characters": title})
+        view.run_command("append", {"characters": format_diff(diffs)})
+        view.set_read_only(True)
+
+
+class ServerSettingKeyInputHandler(sublime_plugin.ListInputHandler):
+
+    def __init__(self, options: DottedDict) -> None:
+        self.options = options
+
+    def name(self) -> str:
+        return "key"
+
+    def placeholder(self) -> str:
+        return "Server setting"
+
+    def list_items(self) -> list[sublime.ListInputItem]:
+        return [
+            sublime.ListInputItem(key, key, annotation=json.dumps(self.options.get(key, default)))
+            for key, default in server_defaults().items()
+        ]
+
+    def next_input(self, args: dict[str, Any]) -> sublime_plugin.TextInputHandler | None:
+        if "value" not in args:
+            key = args["key"]
+            return ServerSettingValueInputHandler(json.dumps(self.options.get(key, server_defaults().get(key))))
+        return None
+
+
+class ServerSettingValueInputHandler(sublime_plugin.TextInputHandler):
+
+    def __init__(self, current: str) -> None:
+        self.current = current
+
+    def name(self) -> str:
+        return "value"
+
+    def placeholder(self) -> str:
+        return "JSON value"
+
+    def initial_text(self) -> str:
+        return self.current
+
+    def validate(self, text: str) -> bool:
+        try:
+            json.loads(text)
+        except ValueError:
+            return False
+        return True
+
+
+class RustAnalyzerChangeServerSettings(LspWindowCommand):
+    """
+    Change server settings of the window's server without restarting it, unless the server only reads them on
+    startup. The settings are kept for the first folder of the window until they are reset.
+    """
+
+    def is_enabled(self, key: str | None = None, value: str | None = None, settings: dict | None = None) -> bool:
+        return self.session_by_name(self.session_name) is not None
+
+    def input(self, args: dict[str, Any]) -> sublime_plugin.CommandInputHandler | None:
+        session = self.session_by_name(self.session_name)
+        if session is None or "settings" in args:
+            return None
+        options = session.config.initialization_options
+        if "key" not in args:
+            return ServerSettingKeyInputHandler(options)
+        if "value" not in args:
+            key = args["key"]
+            return ServerSettingValueInputHandler(json.dumps(options.get(key, server_defaults().get(key))))
+        return None
+
+    def run(self, key: str | None = None, value: str | None = None, settings: dict | None = None) -> None:
+        session = self.session_by_name(self.session_name)
+        if session is None:
+            return
+        if key is not None and value is None:
+            sublime.error_message(f'LSP-rust-analyzer: no value given for the server setting "{key}"')
+            return
+        if shared_session_count(session.config.tcp_port) > 1:
+            # The server only asks the oldest of the sessions that share it for its configuration.
+            sublime.error_message(
+                "LSP-rust-analyzer: the server of this window is shared with other windows. Change the setting in "
+                "the package settings or the project instead, or close the other windows of the workspace first.")
+            return
+        changes = dict(settings or {})
+        if key is not None and value is not None:
+            changes[key] = json.loads(value)
+        options = session.config.initialization_options
+        defaults = server_defaults()
+        changed = {
+            name: setting for name, setting in changes.items() if options.get(name, defaults.get(name)) != setting
+        }
+        if not changed:
+            sublime.status_message("LSP-rust-analyzer: the server settings are unchanged")
+            return
+        if folders := self.window.folders():
+            live_settings = load_live_settings(RustAnalyzer.plugin_storage_path, folders[0])
+            live_settings.update(changed)
+            save_live_settings(RustAnalyzer.plugin_storage_path, folders[0], live_settings)
+        for name, setting in changed.items():
+            options.set(name, setting)
+        session.config.settings.set("rust-analyzer", options.get())
+        if any(requires_restart(name) for name in changed):
+            self.window.run_command("lsp_restart_server", {"config_name": CONFIG_NAME})
+            return
+        # The server asks for its complete configuration with `workspace/configuration` in response.
+        session.send_notification(
+            Notification("workspace/didChangeConfiguration", {"settings": {"rust-analyzer": nest(changed)}}))
+        sublime.status_message(f"LSP-rust-analyzer: applied {', '.join(changed)} without restarting the server")
+
+
+class RustAnalyzerResetServerSettings(LspWindowCommand):
+    """Forget the server settings changed for the window's folder, and restart the server with the configured ones."""
+
+    def is_enabled(self) -> bool:
+        folders = self.window.folders()
+        return (
+            self.session_by_name(self.session_name) is not None and bool(folders)
+            and bool(load_live_settings(RustAnalyzer.plugin_storage_path, folders[0]))
+        )
+
+    def run(self) -> None:
+        if folders := self.window.folders():
+            save_live_settings(RustAnalyzer.plugin_storage_path, folders[0], {})
+            self.window.run_command("lsp_restart_server", {"config_name": CONFIG_NAME})
+
+
+class RustAnalyzerStartupTimeline(sublime_plugin.WindowCommand):
+    """Show how long the server of the window's workspace took to get ready, in its latest and in all recorded runs."""
+
+    def is_enabled(self) -> bool:
+        return bool(self.window.folders())
+
+    def run(self) -> None:
+        workspace = self.window.folders()[0]
+        records = load_timelines(RustAnalyzer.plugin_storage_path / TIMELINES_DIR, workspace)
+        if not records:
+            sublime.status_message(f"No server start of {workspace} has been recorded yet")
+            return
+        view = self.window.new_file(flags=sublime.TRANSIENT)
+        view.set_scratch(True)
+        view.set_name("--- RustAnalyzer Startup Timeline ---")
+        view.run_command("append", {"characters": format_timelines(records)})
+        view.set_read_only(True)
+
+
 class RustAnalyzerExec(LspTextCommand):
 
     def run(self, edit: sublime.Edit) -> None:
@@ -300,6 +970,13 @@ class RustAnalyzerExec(LspTextCommand):
 
 class RustAnalyzerRunProject(RustAnalyzerExec):
 
+    def __init__(self, view: sublime.View) -> None:
+        super().__init__(view)
+        # Incremented whenever a quick panel is shown, to ignore the callback of a panel that got replaced.
+        self._panel_generation = 0
+        self._shown_runnables: list[Runnable] | None = None
+        self._highlighted_label: str | None = None
+
     def is_enabled(self) -> bool:
         selection = self.view.sel()
         if len(selection) == 0:
@@ -311,22 +988,92 @@ class RustAnalyzerRunProject(RustAnalyzerExec):
         session = self.session_by_name(self.session_name)
         if session is None:
             return
-        session.send_request(Request("experimental/runnables", params), self.on_result_async)
+        key = runnables_cache_key(self.view, params)
+        cached_panel: int | None = None
+        if (cached := runnables_cache.get(key)) is not None:
+            self.show_runnables(cached)
+            cached_panel = self._panel_generation
+        send_request_when_quiescent(
+            self, f"runnables:{self.view.id()}",
+            Request("experimental/runnables", params), partial(self.on_result_async, key, cached_panel))
+
+    def on_result_async(self, key: RunnablesCacheKey, cached_panel: int | None, payload: list[Runnable]) -> None:
+        runnables_cache.put(key, payload)
+        if cached_panel is None:
+            self.show_runnables(payload)
+        elif (
+            cached_panel == self._panel_generation
+            and self._shown_runnables is not None
+            and self._shown_runnables != payload
+        ):
+            # Refresh the panel opened from the cache while it is still open.
+            self.show_runnables(payload)
 
-    def on_result_async(self, payload: list[Runnable]) -> None:
-        items = [item["label"] for item in payload]
-        view = self.view
-        window = view.window()
+    def show_runnables(self, payload: list[Runnable]) -> None:
+        window = self.view.window()
         if window is None:
             return
-        window.show_quick_panel(items, partial(self.callback, items, payload))
-
-    def callback(self, items: list[str], payload: list[Runnable], option: int) -> None:
+        items = [item["label"] for item in payload]
+        selected_index = items.index(self._highlighted_label) if self._highlighted_label in items else -1
+        self._panel_generation += 1
+        self._shown_runnables = payload
+        window.show_quick_panel(
+            items,
+            partial(self.callback, self._panel_generation, items, payload),
+            selected_index=selected_index,
+            on_highlight=partial(self.on_highlight, items))
+
+    def on_highlight(self, items: list[str], option: int) -> None:
+        self._highlighted_label = items[option] if option >= 0 else None
+
+    def callback(self, generation: int, items: list[str], payload: list[Runnable], option: int) -> None:
+        if generation != self._panel_generation:
+            # Replaced by a panel with more recent runnables.
+            return
+        self._shown_runnables = None
+        self._highlighted_label = None
         if option == -1:
             return
         self.run_terminus(items[option], payload)
 
 
+class RustAnalyzerPrefetchRunnables(LspTextCommand):
+    """Fetch the runnables at the caret into the cache, so that "Run..." can show them right away."""
+
+    def run(self, edit: sublime.Edit) -> None:
+        if len(self.view.sel()) == 0:
+            return
+        params = text_document_position_params(self.view, self.view.sel()[0].b)
+        key = runnables_cache_key(self.view, params)
+        if runnables_cache.get(key) is not None:
+            return
+        if self.session_by_name(self.session_name):
+            send_request_when_quiescent(
+                self, f"prefetchRunnables:{self.view.id()}",
+                Request("experimental/runnables", params), partial(runnables_cache.put, key))
+
+
+class RustAnalyzerRunnablesPrefetchListener(sublime_plugin.EventListener):
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._generations: dict[int, int] = {}
+
+    def on_selection_modified_async(self, view: sublime.View) -> None:
+        if not view.match_selector(0, "source.rust"):
+            return
+        generation = self._generations[view.id()] = self._generations.get(view.id(), 0) + 1
+        sublime.set_timeout_async(partial(self.prefetch, view, generation), RUNNABLES_PREFETCH_DELAY_MS)
+
+    def on_close(self, view: sublime.View) -> None:
+        self._generations.pop(view.id(), None)
+
+    def prefetch(self, view: sublime.View, generation: int) -> None:
+        # Only prefetch once the caret has settled.
+        if self._generations.get(view.id()) == generation and view.is_valid():
+            view.run_command("rust_analyzer_prefetch_runnables")
+
+
 class RustAnalyzerOpenCargoToml(LspTextCommand):
 
     def is_enabled(self) -> bool:
@@ -365,10 +1112,10 @@ class RustAnalyzerViewItemTree(LspTextCommand):
         session = self.session_by_name(self.session_name)
         if session is None:
             return
-        session.send_request(
+        send_request_when_quiescent(
+            self, f"viewItemTree:{self.view.id()}",
             Request("rust-analyzer/viewItemTree", params),
-            lambda response: sublime.set_timeout(partial(self.on_result, response))
-        )
+            lambda response: sublime.set_timeout(partial(self.on_result, response)))
 
     def on_result(self, out: str | None) -> None:
         window = self.view.window()
@@ -395,6 +1142,10 @@ class RustAnalyzerReloadProject(LspTextCommand):
         session = self.session_by_name(self.session_name)
         if session is None:
             return
+        # Reloading can change the crates and their dependencies that the cached results refer to.
+        runnables_cache.clear()
+        external_docs_cache.clear()
+        clear_expansion_cache()
         session.send_request(Request("rust-analyzer/reloadWorkspace"), lambda _: None)
 
 
@@ -411,10 +1162,10 @@ class RustAnalyzerExpandMacro(LspTextCommand):
         if session is None:
             return
         params = text_document_position_params(self.view, self.view.sel()[0].b)
-        session.send_request(
+        send_request_when_quiescent(
+            self, f"expandMacro:{self.view.id()}",
             Request("rust-analyzer/expandMacro", params),
-            lambda response: sublime.set_timeout(partial(self.on_result, response))
-        )
+            lambda response: sublime.set_timeout(partial(self.on_result, response)))
 
     def on_result(self, expanded_macro: dict[str, str] | None) -> None:
         if expanded_macro is None:
@@ -439,6 +1190,7 @@ class RustAnalyzerExpandMacro(LspTextCommand):
 
 def plugin_loaded() -> None:
     RustAnalyzer.register()
+    start_prewarming(RustAnalyzer.plugin_storage_path)
 
 
 def plugin_unloaded() -> None:
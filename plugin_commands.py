@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from .plugin import get_package_setting
 from LSP.plugin import apply_text_edits
 from LSP.plugin import LspTextCommand
 from LSP.plugin import Request
@@ -9,16 +10,20 @@ from LSP.plugin.core.views import region_to_range
 from LSP.plugin.core.views import text_document_identifier
 from LSP.protocol import InsertTextFormat
 from LSP.protocol import NotRequired
+from LSP.protocol import Position
 from LSP.protocol import Range
 from LSP.protocol import SnippetTextEdit
 from LSP.protocol import TextDocumentIdentifier
 from LSP.protocol import TextEdit
 from typing import List
 from typing import Literal
+from typing import NamedTuple
 from typing import TypedDict
 from typing import Union
+import os
 import re
 import sublime
+import time
 
 
 class JoinLinesRequest:
@@ -47,8 +52,64 @@ class MoveItemRequest:
     ReturnType = List[Union[RASnippetTextEdit, SnippetTextEdit]]
 
 
+class JoinSnapshot(NamedTuple):
+    """The lines that a join affects, before the join."""
+    begin: int
+    row: int
+    """The row of `begin`, which is the start of a line."""
+    text: str
+    version: int
+
+
+class LocalJoin(NamedTuple):
+    snapshot: JoinSnapshot
+    version: int
+    """The change count of the view after the join."""
+    size_difference: int
+
+
+def utf16_offset_to_index(line: str, character: int) -> int:
+    """The index in `line` of the position `character` UTF-16 code units from its start."""
+    if line.isascii():
+        return min(character, len(line))
+    units = 0
+    for index, char in enumerate(line):
+        if units >= character:
+            return index
+        units += 2 if ord(char) > 0xFFFF else 1
+    return len(line)
+
+
+def apply_edits_to_snapshot(snapshot: JoinSnapshot, edits: list[TextEdit]) -> str | None:
+    """The text of the snapshot after the edits, or `None` if an edit reaches outside of it."""
+    lines = snapshot.text.split('\n')
+    line_starts = [0]
+    for line in lines[:-1]:
+        line_starts.append(line_starts[-1] + len(line) + 1)
+
+    def offset(position: Position) -> int | None:
+        row = position['line'] - snapshot.row
+        if not 0 <= row < len(lines):
+            return None
+        return line_starts[row] + utf16_offset_to_index(lines[row], position['character'])
+
+    replacements: list[tuple[int, int, str]] = []
+    for edit in edits:
+        start, end = offset(edit['range']['start']), offset(edit['range']['end'])
+        if start is None or end is None:
+            return None
+        replacements.append((start, end, edit['newText']))
+    text = snapshot.text
+    # Edits don't overlap, so applying them back to front keeps the offsets of the others valid.
+    for start, end, new_text in sorted(replacements, reverse=True):
+        text = text[:start] + new_text + text[end:]
+    return text
+
+
 class RustAnalyzerJoinLinesCommand(LspTextCommand):
 
+    local_join: LocalJoin | None = None
+
     def run(self, edit: sublime.Edit) -> None:
         sublime.set_timeout_async(self.make_request_async)
 
@@ -69,7 +130,14 @@ class RustAnalyzerJoinLinesCommand(LspTextCommand):
         request: Request[JoinLinesRequest.ParamsType, JoinLinesRequest.ReturnType] = Request(JoinLinesRequest.Type, params)
         document_version = self.view.change_count()
         view_listener.purge_changes_async()
-        session.send_request_task(request).then(lambda result: self.on_result_async(result, document_version))
+        if not get_package_setting(session.config, 'optimisticJoinLines', default=False):
+            session.send_request_task(request).then(lambda result: self.on_result_async(result, document_version))
+            return
+        snapshot = self.snapshot()
+        # The request goes out before the change of the local join is sent, so the server joins the same text.
+        session.send_request_task(request).then(
+            lambda result: sublime.set_timeout(lambda: self.reconcile(result, snapshot)))
+        sublime.set_timeout(lambda: self.join_locally(snapshot))
 
     def on_result_async(self, edits: JoinLinesRequest.ReturnType | Error, document_version: int) -> None:
         if isinstance(edits, Error):
@@ -79,6 +147,71 @@ class RustAnalyzerJoinLinesCommand(LspTextCommand):
             return
         apply_text_edits(self.view, edits, required_view_version=document_version)
 
+    def snapshot(self) -> JoinSnapshot:
+        selection = self.view.sel()
+        begin = self.view.line(selection[0].begin()).begin()
+        # Joining a line pulls up the line after it.
+        last_line = self.view.line(selection[-1].end())
+        end = self.view.line(min(last_line.end() + 1, self.view.size())).end()
+        return JoinSnapshot(
+            begin, self.view.rowcol(begin)[0], self.view.substr(sublime.Region(begin, end)), self.view.change_count())
+
+    def join_locally(self, snapshot: JoinSnapshot) -> None:
+        if self.view.change_count() != snapshot.version:
+            return
+        size = self.view.size()
+        self.view.run_command('join_lines')
+        self.local_join = LocalJoin(snapshot, self.view.change_count(), self.view.size() - size)
+
+    def reconcile(self, edits: JoinLinesRequest.ReturnType | Error, snapshot: JoinSnapshot) -> None:
+        """Correct the local join where the server's join differs from it. Runs after `join_locally`."""
+        if isinstance(edits, Error):
+            return
+        local_join = self.local_join
+        version = self.view.change_count()
+        # The local join was skipped, or the view changed after it, so the server's join is outdated.
+        if local_join is None or local_join.snapshot is not snapshot or local_join.version != version:
+            return
+        expected = apply_edits_to_snapshot(snapshot, edits)
+        if expected is None:
+            return
+        # The local join only changes text within the snapshot, so the lines after it shifted by the size difference.
+        region = sublime.Region(snapshot.begin, snapshot.begin + len(snapshot.text) + local_join.size_difference)
+        local = self.view.substr(region)
+        if local == expected:
+            return
+        prefix = len(os.path.commonprefix([local, expected]))
+        suffix = len(os.path.commonprefix([local[prefix:][::-1], expected[prefix:][::-1]]))
+        correction: TextEdit = {
+            'range': region_to_range(self.view, sublime.Region(region.a + prefix, region.b - suffix)),
+            'newText': expected[prefix:len(expected) - suffix],
+        }
+        apply_text_edits(self.view, [correction], required_view_version=version)
+
+
+MOVE_REQUEST_TIMEOUT = 5
+"""Seconds after which a move request without a response no longer holds back the following moves."""
+
+
+class MoveQueue:
+    """The moves of a view that are waiting for the previous move to be applied."""
+
+    def __init__(self) -> None:
+        # Positive for moves down, negative for moves up, so that opposite moves cancel out.
+        self.pending = 0
+        self.sent_at: float | None = None
+        # Counts the sent requests. Only the response to the latest one is applied, as the earlier ones either timed
+        # out or were answered already.
+        self.generation = 0
+
+    @property
+    def in_flight(self) -> bool:
+        return self.sent_at is not None and time.monotonic() - self.sent_at < MOVE_REQUEST_TIMEOUT
+
+
+_move_queues: dict[int, MoveQueue] = {}
+"""The move queues by view id, for the views with moves in progress."""
+
 
 class RustAnalyzerMoveItemCommand(LspTextCommand):
 
@@ -86,21 +219,43 @@ class RustAnalyzerMoveItemCommand(LspTextCommand):
         if direction not in ('Up', 'Down'):
             sublime.status_message('Error running command: direction must be either "Up" or "Down".')
             return
-        sublime.set_timeout_async(lambda: self.make_request_async(direction))
+        sublime.set_timeout_async(lambda: self.enqueue_async(direction))
 
-    def make_request_async(self, direction: MoveItemRequest.Direction) -> None:
+    def enqueue_async(self, direction: MoveItemRequest.Direction) -> None:
+        # Key repeats while a move is in progress are collapsed into a count and sent one after another, each
+        # against the selection that the previous move left behind.
+        queue = _move_queues.setdefault(self.view.id(), MoveQueue())
+        queue.pending += 1 if direction == 'Down' else -1
+        if not queue.in_flight:
+            self.send_next_async()
+
+    def send_next_async(self) -> None:
+        queue = _move_queues.get(self.view.id())
+        if queue is None:
+            return
+        if queue.pending == 0:
+            del _move_queues[self.view.id()]
+            return
+        direction: MoveItemRequest.Direction = 'Down' if queue.pending > 0 else 'Up'
+        queue.pending -= 1 if direction == 'Down' else -1
+        queue.sent_at = time.monotonic()
+        queue.generation += 1
+        if not self.make_request_async(direction, queue, queue.generation):
+            _move_queues.pop(self.view.id(), None)
+
+    def make_request_async(self, direction: MoveItemRequest.Direction, queue: MoveQueue, generation: int) -> bool:
         session = self.session_by_name(self.session_name)
         if session is None:
-            return
+            return False
         session_view = session.session_view_for_view_async(self.view)
         if not session_view:
-            return
+            return False
         view_listener = session_view.listener()
         if not view_listener:
-            return
+            return False
         first_selection = first_selection_region(self.view)
         if first_selection is None:
-            return
+            return False
         params: MoveItemRequest.ParamsType = {
             'textDocument': text_document_identifier(self.view),
             'range': region_to_range(self.view, first_selection),
@@ -109,15 +264,26 @@ class RustAnalyzerMoveItemCommand(LspTextCommand):
         request: Request[MoveItemRequest.ParamsType, MoveItemRequest.ReturnType] = Request(MoveItemRequest.Type, params)
         document_version = self.view.change_count()
         view_listener.purge_changes_async()
-        session.send_request_task(request).then(lambda result: self.on_result_async(result, document_version))
+        session.send_request_task(request).then(
+            lambda result: self.on_result_async(result, document_version, queue, generation))
+        return True
 
-    def on_result_async(self, edits: MoveItemRequest.ReturnType | Error, document_version: int) -> None:
+    def on_result_async(
+        self, edits: MoveItemRequest.ReturnType | Error, document_version: int, queue: MoveQueue, generation: int
+    ) -> None:
+        if _move_queues.get(self.view.id()) is not queue or queue.generation != generation:
+            # A response that came in after its request timed out, which a later move superseded.
+            return
         if document_version != self.view.change_count():
+            # The user edited the document in the meantime, so the remaining moves no longer apply.
+            _move_queues.pop(self.view.id(), None)
             return
         if isinstance(edits, Error):
+            _move_queues.pop(self.view.id(), None)
             sublime.status_message(f'Error handling the "{MoveItemRequest.Type}" request.')
             return
         if not edits:
+            _move_queues.pop(self.view.id(), None)
             sublime.status_message('Did not find anything to move.')
             return
         # Convert custom TextEdit with placeholder into SnippetTextEdit
@@ -128,4 +294,4 @@ class RustAnalyzerMoveItemCommand(LspTextCommand):
                 and re.search(r'(^|[^\\])\$', edit['newText'])
             ):
                 edits[i] = {'range': edit['range'], 'snippet': {'kind': 'snippet', 'value': edit['newText']}}
-        apply_text_edits(self.view, edits)
+        apply_text_edits(self.view, edits).then(lambda _: sublime.set_timeout_async(self.send_next_async))
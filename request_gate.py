@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from functools import partial
+from LSP.plugin import LspTextCommand
+from LSP.plugin import Request
+from LSP.protocol import NotRequired
+from typing import Any
+from typing import Callable
+from typing import Literal
+from typing import TypedDict
+import sublime
+import sublime_plugin
+import threading
+
+GATE_TIMEOUT_MS = 15_000
+"""Send a queued request anyway once it waited this long."""
+
+STATUS_KEY = 'lsp_rust_analyzer_gate'
+
+
+class ServerStatusParams(TypedDict):
+    health: Literal['ok', 'warning', 'error']
+    quiescent: bool
+    message: NotRequired[str]
+
+
+class WindowGate:
+    """
+    Holds back the requests of a window that are expensive or likely to be cancelled while the server is busy loading
+    the workspace.
+
+    The server reports whether it is quiescent (done loading, indexing and building) through the
+    `experimental/serverStatus` notification. Gated requests sent before that are queued per window, coalesced by a
+    key so that only the latest request of each kind is sent, and sent once the server is quiescent, or after a timeout.
+    """
+
+    def __init__(self) -> None:
+        self.status: ServerStatusParams | None = None
+        self.queued: OrderedDict[str, Callable[[], None]] = OrderedDict()
+
+
+_gates: dict[int, WindowGate] = {}
+_lock = threading.Lock()
+
+
+def is_quiescent(window: sublime.Window) -> bool:
+    """Whether the server of the window is quiescent, or doesn't report its status (yet)."""
+    gate = _gates.get(window.id())
+    return gate is None or gate.status is None or gate.status['quiescent']
+
+
+def on_server_status(window: sublime.Window, status: ServerStatusParams) -> None:
+    with _lock:
+        gate = _gates.setdefault(window.id(), WindowGate())
+        gate.status = status
+        ready: list[Callable[[], None]] = []
+        if status['quiescent']:
+            ready = list(gate.queued.values())
+            gate.queued.clear()
+    for send in ready:
+        send()
+    _show_indicator(window)
+
+
+def send_when_quiescent(window: sublime.Window | None, key: str, send: Callable[[], None]) -> None:
+    """
+    Call `send` right away if the server is quiescent, or else once it is. A request queued earlier under the same
+    `key` is dropped in favor of this one.
+    """
+    if window is None or is_quiescent(window):
+        send()
+        return
+    with _lock:
+        gate = _gates.setdefault(window.id(), WindowGate())
+        gate.queued.pop(key, None)
+        gate.queued[key] = send
+    sublime.set_timeout_async(partial(_send_expired, window, key, send), GATE_TIMEOUT_MS)
+    _show_indicator(window)
+
+
+def send_request_when_quiescent(
+    command: LspTextCommand, key: str, request: Request, on_result: Callable[[Any], None]
+) -> None:
+    """
+    Send `request` to the session of `command` once the server is quiescent. The session is looked up when the
+    request is sent, as the server may have been restarted while the request was queued.
+    """
+    def send() -> None:
+        if session := command.session_by_name(command.session_name):
+            session.send_request(request, on_result)
+
+    send_when_quiescent(command.view.window(), key, send)
+
+
+def reset_gate(window: sublime.Window) -> None:
+    """Forget the status of the ended server of the window, and drop the requests that wait for it."""
+    with _lock:
+        _gates.pop(window.id(), None)
+    _show_indicator(window)
+
+
+def _send_expired(window: sublime.Window, key: str, send: Callable[[], None]) -> None:
+    with _lock:
+        gate = _gates.get(window.id())
+        if gate is None or gate.queued.get(key) is not send:
+            return
+        del gate.queued[key]
+    send()
+    _show_indicator(window)
+
+
+def _show_indicator(window: sublime.Window) -> None:
+    gate = _gates.get(window.id())
+    count = len(gate.queued) if gate else 0
+    text = f'rust-analyzer: {count} request{"s" if count > 1 else ""} waiting for indexing' if count else ''
+    sublime.set_timeout(partial(_set_status, window, text))
+
+
+def _set_status(window: sublime.Window, text: str) -> None:
+    for view in window.views():
+        if text:
+            view.set_status(STATUS_KEY, text)
+        else:
+            view.erase_status(STATUS_KEY)
+
+
+class RustAnalyzerRequestGateListener(sublime_plugin.EventListener):
+
+    def on_pre_close_window(self, window: sublime.Window) -> None:
+        with _lock:
+            _gates.pop(window.id(), None)
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+import os
+import re
+import shutil
+import sublime
+import subprocess
+
+MINIMUM_VERSION_DATE = "2025-01-01"
+"""
+The oldest server build (by its commit date) that discovery accepts.
+
+Older builds don't know about a good part of the settings this package sends.
+"""
+
+DISCOVERY_TIMEOUT = 5
+"""Seconds to wait for any single `rustup` or `rust-analyzer` invocation during discovery."""
+
+DiscoveredServer = Tuple[str, str]
+"""The path of a discovered server binary and its version string."""
+
+_discovered: Dict[str, Optional[DiscoveredServer]] = {}
+"""Discovery results per workspace root, including misses, so that each root is probed only once."""
+
+_VERSION_DATE_PATTERN = re.compile(r'\((?:[0-9a-f]+ )?(\d{4}-\d{2}-\d{2})\)')
+
+
+def discover_server(workspace_root: str | None) -> DiscoveredServer | None:
+    """
+    Look for an installed rust-analyzer that is recent enough, preferring the one of the toolchain that
+    `workspace_root` is pinned to (through `rust-toolchain.toml`), then `~/.cargo/bin` and then the `PATH`.
+
+    The result is cached per workspace root.
+    """
+    key = workspace_root or ''
+    if key not in _discovered:
+        _discovered[key] = _probe(workspace_root)
+    return _discovered[key]
+
+
+def _probe(cwd: str | None) -> DiscoveredServer | None:
+    for candidate in _candidates(cwd):
+        version = _server_version(candidate, cwd)
+        if version is not None and _is_recent_enough(version):
+            return candidate, version
+    return None
+
+
+def _candidates(cwd: str | None) -> list[str]:
+    candidates: list[str] = []
+    if rustup := shutil.which('rustup'):
+        output = _run([rustup, 'which', 'rust-analyzer'], cwd)
+        if output:
+            candidates.append(output.strip())
+    filename = 'rust-analyzer.exe' if sublime.platform() == 'windows' else 'rust-analyzer'
+    cargo_bin = Path(os.environ.get('CARGO_HOME') or Path.home() / '.cargo') / 'bin' / filename
+    if cargo_bin.is_file():
+        candidates.append(str(cargo_bin))
+    if on_path := shutil.which('rust-analyzer'):
+        candidates.append(on_path)
+    return list(dict.fromkeys(candidates))
+
+
+def _server_version(server: str, cwd: str | None) -> str | None:
+    output = _run([server, '--version'], cwd)
+    return output.strip() if output and output.startswith('rust-analyzer') else None
+
+
+def _is_recent_enough(version: str) -> bool:
+    # Both `rust-analyzer 1.80.0 (0514789 2024-07-21)` and `rust-analyzer 0.3.2070-standalone (2024-08-19)` end with
+    # the commit date, which can be compared across release channels.
+    match = _VERSION_DATE_PATTERN.search(version)
+    return match is not None and match.group(1) >= MINIMUM_VERSION_DATE
+
+
+def _run(args: list[str], cwd: str | None) -> str | None:
+    startupinfo = None
+    if sublime.platform() == 'windows':
+        startupinfo = subprocess.STARTUPINFO()  # type: ignore
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW  # type: ignore
+    try:
+        process = subprocess.run(
+            args, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            timeout=DISCOVERY_TIMEOUT, startupinfo=startupinfo, universal_newlines=True)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return process.stdout if process.returncode == 0 else None
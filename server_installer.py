@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Callable
+from typing import Optional
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sublime
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zipfile
+
+CHUNK_SIZE = 256 * 1024
+"""Size of the chunks read from the network and from the archive. Bounds the memory used while installing."""
+
+PROGRESS_INTERVAL = 0.25
+"""Minimum number of seconds between two progress reports."""
+
+GITHUB_RELEASE_ASSET = re.compile(r'^https://github\.com/([^/]+)/([^/]+)/releases/download/([^/]+)/([^/]+)$')
+
+ProgressCallback = Callable[[int, Optional[int]], None]
+"""Called with the number of bytes downloaded so far and the total size, if known."""
+
+
+def status_bar_progress(title: str) -> ProgressCallback:
+    """Return a progress callback that reports the download progress in the status bar."""
+
+    def report(done: int, total: int | None) -> None:
+        if total:
+            sublime.status_message(f'{title}: {done * 100 // total}% ({done >> 20}/{total >> 20} MiB)')
+        else:
+            sublime.status_message(f'{title}: {done >> 20} MiB')
+
+    return report
+
+
+def download_file(url: str, target: Path, on_progress: ProgressCallback | None = None) -> None:
+    """
+    Download `url` into `target` in chunks.
+
+    The data is first written to `<target>.part`. If that file is left over from an interrupted download, only the
+    missing bytes are requested from the server (when it supports range requests). The partial file is kept on
+    failure so that the next attempt can resume.
+    """
+    partial = target.with_name(target.name + '.part')
+    offset = partial.stat().st_size if partial.is_file() else 0
+    request = urllib.request.Request(url)
+    if offset:
+        request.add_header('Range', f'bytes={offset}-')
+    try:
+        response = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as ex:
+        if ex.code != 416 or not offset:
+            raise
+        # Range not satisfiable: the partial file already holds the whole content.
+        partial.replace(target)
+        return
+    with response:
+        if offset and response.status != 206:
+            # The server ignored the range request and sends the whole content.
+            offset = 0
+        length = response.headers.get('Content-Length')
+        total = offset + int(length) if length is not None else None
+        done = offset
+        last_report = 0.0
+        with open(partial, 'ab' if offset else 'wb') as f:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                done += len(chunk)
+                if on_progress and (now := time.monotonic()) - last_report >= PROGRESS_INTERVAL:
+                    last_report = now
+                    on_progress(done, total)
+    if total is not None and done < total:
+        raise OSError(f'Download of {url} ended prematurely ({done} of {total} bytes)')
+    if on_progress:
+        on_progress(done, total)
+    partial.replace(target)
+
+
+def local_path(url: str) -> Path | None:
+    """Return the local path `url` refers to (a `file://` URL or a plain path) or `None` for remote URLs."""
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme == 'file':
+        return Path(urllib.request.url2pathname(parsed.path))
+    # A single letter scheme is a Windows drive letter.
+    if len(parsed.scheme) <= 1:
+        return Path(url)
+    return None
+
+
+def sha256_of(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def checksum_path(archive: Path) -> Path:
+    return archive.with_name(archive.name + '.sha256')
+
+
+def read_checksum(archive: Path) -> str | None:
+    """Return the checksum from the `<archive>.sha256` file next to `archive`, if there is one."""
+    try:
+        content = checksum_path(archive).read_text(encoding='utf-8').split()
+    except OSError:
+        return None
+    # Accept both a bare digest and the `sha256sum` output format.
+    return content[0].lower() if content else None
+
+
+def published_checksum(url: str) -> str | None:
+    """
+    Return the sha256 checksum published for the archive at the remote `url`, if there is one.
+
+    For GitHub release assets this is the digest that GitHub records for the asset. Other servers have to provide
+    it as `<url>.sha256`.
+    """
+    if match := GITHUB_RELEASE_ASSET.match(url):
+        owner, repository, tag, name = match.groups()
+        request = urllib.request.Request(
+            f'https://api.github.com/repos/{owner}/{repository}/releases/tags/{tag}',
+            headers={'Accept': 'application/vnd.github+json'})
+        with urllib.request.urlopen(request) as response:
+            release = json.load(response)
+        for asset in release.get('assets', []):
+            digest = asset.get('digest') or ''
+            if asset.get('name') == name and digest.startswith('sha256:'):
+                return digest[len('sha256:'):].lower()
+        return None
+    try:
+        with urllib.request.urlopen(f'{url}.sha256') as response:
+            content = response.read().decode('utf-8', 'replace').split()
+    except urllib.error.HTTPError as ex:
+        if ex.code == 404:
+            return None
+        raise
+    return content[0].lower() if content else None
+
+
+def verify_checksum(archive: Path, expected: str | None) -> None:
+    """
+    Verify `archive` against the `expected` sha256 checksum.
+
+    Raises `ValueError` when there is no checksum to verify against or when the checksum doesn't match.
+    """
+    if expected is None:
+        raise ValueError(f'No sha256 checksum is published for {archive.name}, so it cannot be verified')
+    actual = sha256_of(archive)
+    if actual != expected:
+        raise ValueError(f'Checksum mismatch for {archive}: expected {expected}, got {actual}')
+
+
+def is_valid_cache_entry(archive: Path) -> bool:
+    """Whether `archive` exists in the cache together with a matching checksum."""
+    if not archive.is_file():
+        return False
+    expected = read_checksum(archive)
+    return expected is not None and sha256_of(archive) == expected
+
+
+def store_in_cache(archive: Path, cached: Path, checksum: str) -> None:
+    """
+    Copy the verified `archive` to `cached` along with its published `checksum`.
+
+    The copy is written to a temporary file in the cache first so that other processes reading the cache never
+    see a partially written archive.
+    """
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f'.{cached.name}-', dir=str(cached.parent))
+    try:
+        with os.fdopen(fd, 'wb') as dst, open(archive, 'rb') as src:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        checksum_path(cached).write_text(f'{checksum}  {cached.name}\n', encoding='utf-8')
+        os.replace(tmp, cached)
+    except BaseException:
+        Path(tmp).unlink()
+        raise
+
+
+def extract_gzip(archive: Path, target: Path) -> None:
+    """Decompress a gzip `archive` into `target` without loading either of them in memory."""
+    with gzip.open(archive, 'rb') as src, open(target, 'wb') as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+def extract_zip_member(archive: Path, member: str, target_dir: Path) -> None:
+    """Extract a single `member` of a zip `archive` into `target_dir`."""
+    with zipfile.ZipFile(archive, 'r') as zip_ref:
+        zip_ref.extract(member, target_dir)
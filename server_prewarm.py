@@ -0,0 +1,325 @@
+from __future__ import annotations
+
+from .live_settings import nest
+from .server_sharing import cargo_workspace_root
+from .server_sharing import encode_message
+from .server_sharing import read_message
+from .server_sharing import shared_server
+from .server_sharing import shared_server_port
+from .server_sharing import TOKEN_OPTION
+from pathlib import Path
+from typing import Any
+from typing import TypedDict
+import copy
+import hashlib
+import json
+import os
+import socket
+import sublime
+import sublime_plugin
+import threading
+import time
+
+RECENT_WORKSPACES_FILE = '.recent-workspaces.json'
+
+MAX_RECENT_WORKSPACES = 20
+
+STARTUP_DELAY_MS = 5000
+"""Let Sublime Text finish loading before pre-warming."""
+
+BUSY_LOAD_PER_CORE = 0.75
+"""The machine is busy while its 1-minute load average per CPU exceeds this."""
+
+BUSY_RETRY_INTERVAL = 30
+MAX_BUSY_WAIT = 600
+"""Seconds to defer a pre-warm for at most while the machine is busy."""
+
+INITIALIZE_TIMEOUT = 120
+"""Seconds to wait for the server to answer `initialize` before giving up on the pre-warm."""
+
+QUIESCENT_TIMEOUT = 600
+"""Seconds after which a pre-warm no longer counts against the concurrency limit, even if indexing continues."""
+
+KEEP_ALIVE = 30 * 60
+"""Seconds to keep a pre-warmed server running when no window uses it."""
+
+
+class RecentWorkspace(TypedDict):
+    root: str
+    command: list[str]
+    env_hash: str
+    """
+    A hash of the `env` of the session, which may hold secrets and is therefore not stored. The workspace is only
+    pre-warmed while the configured `env` is the same.
+    """
+    initialize_params: Any
+    """
+    The params of the `initialize` request of the last session, or `None` if unknown. The `extraEnv` settings are left
+    out of its `initializationOptions`, as they may hold secrets too, and are read from the settings when pre-warming.
+    """
+    extra_env_hash: str | None
+    """A hash of the `extraEnv` settings of the last session. The workspace is only pre-warmed while they are the same."""
+    used: float
+
+
+_recent_workspaces_path: Path | None = None
+_file_lock = threading.Lock()
+_prewarming: set[str] = set()
+_semaphore: threading.Semaphore | None = None
+
+
+def settings() -> sublime.Settings:
+    return sublime.load_settings('LSP-rust-analyzer.sublime-settings')
+
+
+def env_hash(env: dict[str, str]) -> str:
+    return hashlib.sha256(json.dumps(env, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def configured_env() -> dict[str, str]:
+    return settings().get('env') or {}
+
+
+def split_extra_env(options: dict[str, Any], prefix: str = '') -> tuple[dict[str, Any], dict[str, Any]]:
+    """The (nested) `options` without the `extraEnv` settings, and the non-empty ones of those by their dotted keys."""
+    stripped: dict[str, Any] = {}
+    extra_env: dict[str, Any] = {}
+    for key, value in options.items():
+        if key == 'extraEnv':
+            if value:
+                extra_env[f'{prefix}{key}'] = value
+        elif isinstance(value, dict):
+            stripped[key], nested_extra_env = split_extra_env(value, f'{prefix}{key}.')
+            extra_env.update(nested_extra_env)
+        else:
+            stripped[key] = value
+    return stripped, extra_env
+
+
+def without_extra_env(initialize_params: Any) -> tuple[Any, dict[str, Any]]:
+    options, extra_env = split_extra_env(initialize_params.get('initializationOptions') or {})
+    return {**initialize_params, 'initializationOptions': options}, extra_env
+
+
+def with_extra_env(options: dict[str, Any], extra_env: dict[str, Any]) -> dict[str, Any]:
+    options = copy.deepcopy(options)
+    for key, value in extra_env.items():
+        *parents, name = key.split('.')
+        target = options
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[name] = value
+    return options
+
+
+def configured_extra_env() -> dict[str, Any]:
+    return split_extra_env(nest(settings().get('initialization_options') or {}))[1]
+
+
+def load_recent_workspaces() -> list[RecentWorkspace]:
+    if _recent_workspaces_path is None or not _recent_workspaces_path.is_file():
+        return []
+    try:
+        return json.loads(_recent_workspaces_path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return []
+
+
+def remember_workspace(root: str, command: list[str], env: dict[str, str], initialize_params: Any = None) -> None:
+    """Move `root` to the front of the recently used workspaces, keeping its `initialize` params if not given."""
+    if _recent_workspaces_path is None:
+        return
+    with _file_lock:
+        workspaces = load_recent_workspaces()
+        previous = next((workspace for workspace in workspaces if workspace['root'] == root), None)
+        extra_env_hash = None
+        if initialize_params is not None:
+            initialize_params, extra_env = without_extra_env(initialize_params)
+            extra_env_hash = env_hash(extra_env)
+        elif previous is not None and previous['initialize_params'] is not None:
+            initialize_params = without_extra_env(previous['initialize_params'])[0]
+            extra_env_hash = previous.get('extra_env_hash')
+        workspaces = [workspace for workspace in workspaces if workspace['root'] != root]
+        workspaces.insert(0, {
+            'root': root, 'command': command, 'env_hash': env_hash(env), 'initialize_params': initialize_params,
+            'extra_env_hash': extra_env_hash, 'used': time.time(),
+        })
+        _recent_workspaces_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = _recent_workspaces_path.with_suffix('.tmp')
+        temporary.write_text(json.dumps(workspaces[:MAX_RECENT_WORKSPACES]), encoding='utf-8')
+        os.replace(temporary, _recent_workspaces_path)
+
+
+def is_prewarmed(root: str, count: int) -> bool:
+    """Whether `root` is among the `count` most recently used workspaces, which are the ones that are pre-warmed."""
+    return any(workspace['root'] == root for workspace in load_recent_workspaces()[:count])
+
+
+def is_busy() -> bool:
+    try:
+        load = os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return False
+    return load / (os.cpu_count() or 1) > BUSY_LOAD_PER_CORE
+
+
+def prewarm(roots: list[str] | None = None) -> None:
+    """Pre-warm the given workspace roots, or the most recently used ones, if they have been used before."""
+    count = settings().get('prewarm_workspaces') or 0
+    if not count or _semaphore is None:
+        return
+    workspaces = load_recent_workspaces()[:count]
+    if roots is not None:
+        workspaces = [workspace for workspace in workspaces if workspace['root'] in roots]
+    env = configured_env()
+    extra_env = configured_extra_env()
+    for workspace in workspaces:
+        root = workspace['root']
+        if workspace['initialize_params'] is None or root in _prewarming or not os.path.isdir(root):
+            continue
+        if workspace.get('env_hash') != env_hash(env) or workspace.get('extra_env_hash') != env_hash(extra_env):
+            # The server would run with another environment than the sessions of the workspace.
+            continue
+        if shared_server(root) is not None:
+            continue
+        _prewarming.add(root)
+        threading.Thread(target=_prewarm_workspace, args=(workspace, _semaphore), daemon=True).start()
+
+
+def _prewarm_workspace(workspace: RecentWorkspace, semaphore: threading.Semaphore) -> None:
+    root = workspace['root']
+    try:
+        with semaphore:
+            deadline = time.monotonic() + MAX_BUSY_WAIT
+            while is_busy() and time.monotonic() < deadline:
+                time.sleep(BUSY_RETRY_INTERVAL)
+            # A window may have opened the workspace in the meantime.
+            if shared_server(root) is not None:
+                return
+            print(f'LSP-rust-analyzer: pre-warming the server of {root}')
+            port, token = shared_server_port(root, workspace['command'], configured_env())
+            connection = socket.create_connection(('127.0.0.1', port))
+            client = PrewarmClient(connection, workspace, token)
+            if not client.initialize():
+                connection.close()
+                return
+            client.wait_until_quiescent()
+        client.wait_for_session()
+    except OSError as ex:
+        print(f'LSP-rust-analyzer: pre-warming the server of {root} failed: {ex}')
+    finally:
+        _prewarming.discard(root)
+
+
+class PrewarmClient:
+    """
+    A minimal LSP client that initializes a shared server and keeps it alive until a window's session joins.
+
+    Pre-warmed servers are shared servers (see `server_sharing.py`) that a background client initializes with the
+    `initialize` params that the last session of the workspace sent. Once a session of a window joins, it takes over
+    the initialized server and the background client disconnects.
+    """
+
+    def __init__(self, connection: socket.socket, workspace: RecentWorkspace, token: str) -> None:
+        self.connection = connection
+        self.reader = connection.makefile('rb')
+        self.workspace = workspace
+        self.token = token
+        stored_options = workspace['initialize_params'].get('initializationOptions') or {}
+        self.options = with_extra_env(stored_options, configured_extra_env())
+        self.initialized = threading.Event()
+        self.quiescent = threading.Event()
+        self.closed = threading.Event()
+        self._send_lock = threading.Lock()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def send(self, message: dict[str, Any]) -> None:
+        with self._send_lock:
+            self.connection.sendall(encode_message({'jsonrpc': '2.0', **message}))
+
+    def initialize(self) -> bool:
+        params = self.workspace['initialize_params']
+        options = {**self.options, TOKEN_OPTION: self.token}
+        params = {**params, 'processId': os.getpid(), 'initializationOptions': options}
+        self.send({'id': 1, 'method': 'initialize', 'params': params})
+        return self.initialized.wait(INITIALIZE_TIMEOUT) and not self.closed.is_set()
+
+    def wait_until_quiescent(self) -> None:
+        deadline = time.monotonic() + QUIESCENT_TIMEOUT
+        while not self.quiescent.wait(1) and time.monotonic() < deadline:
+            if self.session_joined():
+                return
+
+    def session_joined(self) -> bool:
+        server = shared_server(self.workspace['root'])
+        return server is not None and len(server.clients) > 1
+
+    def wait_for_session(self) -> None:
+        """Keep the server alive until a session takes it over, or until nobody needed it for too long."""
+        deadline = time.monotonic() + KEEP_ALIVE
+        try:
+            while time.monotonic() < deadline and not self.closed.is_set():
+                if shared_server(self.workspace['root']) is None:
+                    return
+                if self.session_joined():
+                    break
+                self.closed.wait(1)
+            if not self.closed.is_set():
+                self.send({'id': 2, 'method': 'shutdown'})
+                self.send({'method': 'exit'})
+        finally:
+            self.connection.close()
+
+    def _read(self) -> None:
+        try:
+            while (message := read_message(self.reader)) is not None:
+                self._on_message(message)
+        except (OSError, ValueError):
+            pass
+        self.closed.set()
+        self.initialized.set()
+        self.quiescent.set()
+
+    def _on_message(self, message: dict[str, Any]) -> None:
+        method = message.get('method')
+        if method is None:
+            if message.get('id') == 1:
+                if 'result' not in message:
+                    self.connection.close()
+                    return
+                self.send({'method': 'initialized', 'params': {}})
+                self.initialized.set()
+        elif method == 'experimental/serverStatus':
+            if message['params'].get('quiescent'):
+                self.quiescent.set()
+        elif 'id' in message:
+            self.send({'id': message['id'], 'result': self.answer(method, message.get('params'))})
+
+    def answer(self, method: str, params: Any) -> Any:
+        if method == 'workspace/configuration':
+            return [self.options for _ in params['items']]
+        return None
+
+
+class RustAnalyzerPrewarmListener(sublime_plugin.EventListener):
+
+    def on_load_project_async(self, window: sublime.Window) -> None:
+        self.prewarm_window(window)
+
+    def on_new_window_async(self, window: sublime.Window) -> None:
+        self.prewarm_window(window)
+
+    def prewarm_window(self, window: sublime.Window) -> None:
+        roots = [
+            cargo_workspace_root(folder) for folder in window.folders()
+            if os.path.isfile(os.path.join(folder, 'Cargo.toml'))
+        ]
+        if roots:
+            prewarm(roots)
+
+
+def start_prewarming(storage_path: Path) -> None:
+    global _recent_workspaces_path, _semaphore
+    _recent_workspaces_path = storage_path / RECENT_WORKSPACES_FILE
+    _semaphore = threading.Semaphore(max(1, settings().get('prewarm_concurrency') or 1))
+    sublime.set_timeout_async(prewarm, STARTUP_DELAY_MS)
@@ -0,0 +1,475 @@
+from __future__ import annotations
+
+from itertools import count
+from pathlib import Path
+from typing import Any
+from typing import BinaryIO
+from typing import Callable
+from typing import Dict
+import hmac
+import json
+import os
+import queue
+import secrets
+import socket
+import subprocess
+import threading
+import time
+
+Message = Dict[str, Any]
+
+SHUTDOWN_TIMEOUT = 10
+"""Seconds to wait for the server to exit after the last session disconnected."""
+
+CONNECT_TIMEOUT = 30
+"""Seconds that a session which was handed the port keeps the server alive without connecting."""
+
+TOKEN_OPTION = 'lspRustAnalyzerSharingToken'
+"""The key of the token in the `initializationOptions` of the `initialize` request."""
+
+DOCUMENT_NOTIFICATIONS = {
+    'textDocument/didChange', 'textDocument/willSave', 'textDocument/didSave',
+}
+
+PRIMARY_NOTIFICATIONS = {
+    'workspace/didChangeConfiguration', 'workspace/didChangeWatchedFiles', 'workspace/didChangeWorkspaceFolders',
+    'workspace/didCreateFiles', 'workspace/didRenameFiles', 'workspace/didDeleteFiles',
+}
+"""Notifications about the workspace, which every session sends alike and the server should only see once."""
+
+_REPLAY_ID_PREFIX = 'lsp-rust-analyzer-sharing/'
+
+
+def read_message(stream: BinaryIO) -> Message | None:
+    """Read a JSON-RPC message with its base protocol headers, or return `None` at the end of the stream."""
+    length = 0
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            break
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    body = stream.read(length)
+    if len(body) < length:
+        return None
+    return json.loads(body)
+
+
+def encode_message(message: Message) -> bytes:
+    body = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    return b'Content-Length: %d\r\n\r\n%s' % (len(body), body)
+
+
+def cargo_workspace_root(folder: str) -> str:
+    """
+    The root of the Cargo workspace that `folder` belongs to: the outermost `Cargo.toml` with a `[workspace]`
+    table, else the nearest `Cargo.toml`, else `folder` itself.
+    """
+    path = Path(folder).resolve()
+    nearest: Path | None = None
+    workspace: Path | None = None
+    for directory in (path, *path.parents):
+        manifest = directory / 'Cargo.toml'
+        if not manifest.is_file():
+            continue
+        nearest = nearest or directory
+        try:
+            if any(line.strip() == '[workspace]' for line in manifest.read_text(encoding='utf-8').splitlines()):
+                workspace = directory
+        except (OSError, UnicodeDecodeError):
+            continue
+    return str(workspace or nearest or path)
+
+
+class MessageWriter:
+    """
+    Writes messages on a thread of its own, in the order they were sent.
+
+    A peer that doesn't read for a while, like a server that is busy writing a burst of diagnostics, then only
+    delays its own messages instead of blocking the threads that route the messages of all sessions.
+    """
+
+    def __init__(self, write: Callable[[bytes], None], on_close: Callable[[], None] = lambda: None) -> None:
+        self._write = write
+        self._on_close = on_close
+        self._queue: queue.SimpleQueue[bytes | None] = queue.SimpleQueue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def send(self, message: Message) -> None:
+        self._queue.put(encode_message(message))
+
+    def close(self) -> None:
+        """Stop, and call `on_close`, once the messages sent so far are written."""
+        self._queue.put(None)
+
+    def _run(self) -> None:
+        try:
+            while (data := self._queue.get()) is not None:
+                self._write(data)
+        except OSError:
+            pass
+        finally:
+            self._on_close()
+
+
+class Client:
+    """A connected LSP session."""
+
+    def __init__(self, connection: socket.socket) -> None:
+        self.connection = connection
+        self.reader = connection.makefile('rb')
+        self._writer = MessageWriter(connection.sendall, self._disconnect)
+        # Whether the session sent the token of the server. Other messages of the session are ignored until then.
+        self.authenticated = False
+        self.initialized = False
+
+    def send(self, message: Message) -> None:
+        self._writer.send(message)
+
+    def close(self) -> None:
+        self._writer.close()
+
+    def _disconnect(self) -> None:
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+
+
+class SharedServer:
+    """
+    Share one rust-analyzer process between the windows that are opened on the same Cargo workspace.
+
+    Every window still gets its own LSP session, which connects over TCP to a multiplexer running in the plugin host.
+    The multiplexer starts the server once per workspace root and:
+
+    - only accepts sessions whose `initialize` request carries the random token of the server in its
+      `initializationOptions`, so that other local processes can't talk to the server,
+    - forwards the first `initialize` request and answers those of later sessions from the cached result,
+    - gives each session's requests ids of their own and routes the responses back,
+    - sends requests from the server to the oldest session, and notifications to all of them,
+    - forwards the document synchronization of a file only from the first session that opened it, as the sessions
+      of all windows report the same (shared) buffer,
+    - shuts the server down when the last session disconnects.
+    """
+
+    def __init__(
+        self, root: str, command: list[str], env: dict[str, str], on_initialize: Callable[[Any], None] | None = None
+    ) -> None:
+        self.root = root
+        self.on_initialize = on_initialize
+        self.process = subprocess.Popen(
+            command, cwd=root, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.port: int = self.listener.getsockname()[1]
+        self.token = secrets.token_hex(16)
+        # The authenticated sessions, oldest first.
+        self.clients: list[Client] = []
+        self.closed = False
+        # The deadlines of the sessions that were handed the port but didn't connect yet, which keep the server alive.
+        self._expected_clients: list[float] = []
+        # Guards the routing state below. Messages are only queued while holding it, never written.
+        self._lock = threading.RLock()
+        self._server_writer = MessageWriter(self._write_to_server)
+        self._ids = count(1)
+        # Our request id -> the session and its own id of the request.
+        self._pending: dict[int, tuple[Client, Any]] = {}
+        self._initialize_result: Any = None
+        self._initialize_requester: Client | None = None
+        self._waiting_for_initialize: list[tuple[Client, Any]] = []
+        self._registrations: dict[str, Any] = {}
+        # The sessions that opened each document, in order. The first one owns the document.
+        self._documents: dict[str, list[Client]] = {}
+        threading.Thread(target=self._accept, daemon=True).start()
+        threading.Thread(target=self._read_server, daemon=True).start()
+        threading.Thread(target=self._read_server_errors, daemon=True).start()
+
+    @property
+    def primary(self) -> Client | None:
+        return self.clients[0] if self.clients else None
+
+    def is_alive(self) -> bool:
+        return not self.closed and self.process.poll() is None
+
+    def _send_to_server(self, message: Message) -> None:
+        self._server_writer.send(message)
+
+    def _write_to_server(self, data: bytes) -> None:
+        assert self.process.stdin
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+
+    def _accept(self) -> None:
+        while not self.closed:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            client = Client(connection)
+            threading.Thread(target=self._read_client, args=(client,), daemon=True).start()
+
+    def expect_client(self) -> None:
+        """Keep the server alive for a session that is about to connect, for at most `CONNECT_TIMEOUT` seconds."""
+        with self._lock:
+            self._expected_clients.append(time.monotonic() + CONNECT_TIMEOUT)
+        timer = threading.Timer(CONNECT_TIMEOUT + 1, self._drop_expired_clients)
+        timer.daemon = True
+        timer.start()
+
+    def _drop_expired_clients(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._expected_clients = [deadline for deadline in self._expected_clients if deadline > now]
+            idle = not self.clients and not self._expected_clients
+        if idle:
+            self.shutdown()
+
+    def _authenticate(self, client: Client, message: Message) -> bool:
+        """Accept the session if its first message is an `initialize` request with the token of the server."""
+        options = (message.get('params') or {}).get('initializationOptions')
+        token = options.pop(TOKEN_OPTION, None) if isinstance(options, dict) else None
+        if message.get('method') != 'initialize' or not isinstance(token, str):
+            return False
+        if not hmac.compare_digest(token, self.token) or self.closed:
+            return False
+        client.authenticated = True
+        self.clients.append(client)
+        if self._expected_clients:
+            self._expected_clients.pop(0)
+        return True
+
+    def _read_client(self, client: Client) -> None:
+        try:
+            while (message := read_message(client.reader)) is not None:
+                with self._lock:
+                    if not client.authenticated and not self._authenticate(client, message):
+                        break
+                    if not self._on_client_message(client, message):
+                        break
+        except (OSError, ValueError):
+            pass
+        self._detach(client)
+
+    def _read_server(self) -> None:
+        assert self.process.stdout
+        while (message := read_message(self.process.stdout)) is not None:  # type: ignore
+            with self._lock:
+                self._on_server_message(message)
+        self.close()
+
+    def _read_server_errors(self) -> None:
+        assert self.process.stderr
+        for line in self.process.stderr:
+            print(f'LSP-rust-analyzer: shared server of {self.root}: {line.decode("utf-8", "replace").rstrip()}')
+
+    def _on_client_message(self, client: Client, message: Message) -> bool:
+        """Handle a message of a session. Return `False` when the session exits."""
+        method = message.get('method')
+        if method is None:
+            # The response to a request of the server, whose ids are passed through unchanged.
+            if not str(message.get('id')).startswith(_REPLAY_ID_PREFIX):
+                self._send_to_server(message)
+        elif 'id' in message:
+            self._on_client_request(client, message)
+        elif method == 'exit':
+            return False
+        else:
+            self._on_client_notification(client, method, message)
+        return True
+
+    def _on_client_request(self, client: Client, message: Message) -> None:
+        method = message['method']
+        if method == 'initialize':
+            if self._initialize_result is not None:
+                client.send({'jsonrpc': '2.0', 'id': message['id'], 'result': self._initialize_result})
+                return
+            if self._initialize_requester is not None:
+                self._waiting_for_initialize.append((client, message['id']))
+                return
+            self._initialize_requester = client
+            if self.on_initialize:
+                self.on_initialize(message.get('params'))
+        elif method == 'shutdown':
+            # The server is shut down when the last session is gone.
+            client.send({'jsonrpc': '2.0', 'id': message['id'], 'result': None})
+            return
+        request_id = next(self._ids)
+        self._pending[request_id] = (client, message['id'])
+        self._send_to_server({**message, 'id': request_id})
+
+    def _on_client_notification(self, client: Client, method: str, message: Message) -> None:
+        params = message.get('params') or {}
+        if method == 'initialized':
+            if not client.initialized:
+                client.initialized = True
+                if client is self._initialize_requester:
+                    self._send_to_server(message)
+                else:
+                    self._replay_registrations(client)
+        elif method == '$/cancelRequest':
+            for request_id, (requester, original_id) in self._pending.items():
+                if requester is client and original_id == params.get('id'):
+                    self._send_to_server({**message, 'params': {'id': request_id}})
+                    break
+        elif method == 'textDocument/didOpen':
+            uri = params['textDocument']['uri']
+            openers = self._documents.setdefault(uri, [])
+            if not openers:
+                self._send_to_server(message)
+            openers.append(client)
+        elif method == 'textDocument/didClose':
+            self._close_document(client, params['textDocument']['uri'])
+        elif method in DOCUMENT_NOTIFICATIONS:
+            openers = self._documents.get(params['textDocument']['uri'])
+            if openers and openers[0] is client:
+                self._send_to_server(message)
+        elif method in PRIMARY_NOTIFICATIONS:
+            if client is self.primary:
+                self._send_to_server(message)
+        else:
+            self._send_to_server(message)
+
+    def _close_document(self, client: Client, uri: str) -> None:
+        openers = self._documents.get(uri)
+        if not openers or client not in openers:
+            return
+        openers.remove(client)
+        if not openers:
+            del self._documents[uri]
+            self._send_to_server({
+                'jsonrpc': '2.0', 'method': 'textDocument/didClose', 'params': {'textDocument': {'uri': uri}}})
+
+    def _on_server_message(self, message: Message) -> None:
+        method = message.get('method')
+        if method is None:
+            pending = self._pending.pop(message.get('id'), None)  # type: ignore
+            if pending is None:
+                return
+            client, original_id = pending
+            if client is self._initialize_requester and 'result' in message and self._initialize_result is None:
+                self._initialize_result = message['result']
+                for waiting, waiting_id in self._waiting_for_initialize:
+                    waiting.send({**message, 'id': waiting_id})
+                self._waiting_for_initialize.clear()
+            client.send({**message, 'id': original_id})
+            return
+        if method == 'client/registerCapability':
+            for registration in message['params']['registrations']:
+                self._registrations[registration['id']] = registration
+        elif method == 'client/unregisterCapability':
+            for unregistration in message['params']['unregisterations']:
+                self._registrations.pop(unregistration['id'], None)
+        if 'id' not in message:
+            for client in self.clients:
+                client.send(message)
+        elif primary := self.primary:
+            primary.send(message)
+        elif 'id' in message:
+            self._send_to_server({
+                'jsonrpc': '2.0', 'id': message['id'],
+                'error': {'code': -32603, 'message': 'no session is connected'},
+            })
+
+    def _replay_registrations(self, client: Client) -> None:
+        """Let a session that joined late know about the capabilities that the server registered dynamically."""
+        if self._registrations:
+            client.send({
+                'jsonrpc': '2.0', 'id': f'{_REPLAY_ID_PREFIX}{next(self._ids)}', 'method': 'client/registerCapability',
+                'params': {'registrations': list(self._registrations.values())},
+            })
+
+    def _detach(self, client: Client) -> None:
+        with self._lock:
+            if client not in self.clients:
+                client.close()
+                return
+            self.clients.remove(client)
+            for uri in [uri for uri, openers in self._documents.items() if client in openers]:
+                self._close_document(client, uri)
+            for request_id in [request_id for request_id, (c, _) in self._pending.items() if c is client]:
+                del self._pending[request_id]
+            self._waiting_for_initialize = [(c, i) for c, i in self._waiting_for_initialize if c is not client]
+            was_initialize_requester = client is self._initialize_requester
+            last = not self.clients and not self._expected_clients
+        client.close()
+        if last or (was_initialize_requester and self._initialize_result is None):
+            # Without an initialized server there's nothing to share, so the remaining sessions are dropped too.
+            self.shutdown()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            clients, self.clients = self.clients, []
+        self.listener.close()
+        for client in clients:
+            client.close()
+        self._send_to_server({'jsonrpc': '2.0', 'id': next(self._ids), 'method': 'shutdown'})
+        self._send_to_server({'jsonrpc': '2.0', 'method': 'exit'})
+        self._server_writer.close()
+        try:
+            self.process.wait(SHUTDOWN_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        with _shared_servers_lock:
+            if _shared_servers.get(self.root) is self:
+                del _shared_servers[self.root]
+
+    def close(self) -> None:
+        """Called when the server exited on its own."""
+        with self._lock:
+            self.closed = True
+            clients, self.clients = self.clients, []
+        self.listener.close()
+        for client in clients:
+            client.close()
+        with _shared_servers_lock:
+            if _shared_servers.get(self.root) is self:
+                del _shared_servers[self.root]
+
+
+_shared_servers: dict[str, SharedServer] = {}
+"""The running shared servers by their Cargo workspace root."""
+
+_shared_servers_lock = threading.Lock()
+
+
+def shared_server(root: str) -> SharedServer | None:
+    """The running shared server of a Cargo workspace root, if any."""
+    with _shared_servers_lock:
+        server = _shared_servers.get(root)
+    return server if server is not None and server.is_alive() else None
+
+
+def shared_server_port(
+    folder: str, command: list[str], env: dict[str, str] | None = None,
+    on_initialize: Callable[[Any], None] | None = None
+) -> tuple[int, str]:
+    """
+    Return the port and the token of the multiplexer for the Cargo workspace of `folder`, starting the server
+    with `command` when no window is using it yet. `on_initialize` is called with the params of the `initialize`
+    request that a new server receives.
+    """
+    root = cargo_workspace_root(folder)
+    with _shared_servers_lock:
+        server = _shared_servers.get(root)
+        if server is None or not server.is_alive():
+            server = _shared_servers[root] = SharedServer(root, command, {**os.environ, **(env or {})}, on_initialize)
+        server.expect_client()
+        return server.port, server.token
+
+
+def shared_session_count(port: int | None) -> int:
+    """The number of sessions that use the shared server on `port`, or 0 if no shared server listens there."""
+    with _shared_servers_lock:
+        servers = list(_shared_servers.values())
+    for server in servers:
+        if server.port == port and server.is_alive():
+            return len(server.clients)
+    return 0
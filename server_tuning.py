@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+import os
+import re
+import sublime
+import time
+
+GIB = 1 << 30
+
+TUNED_DEFAULTS = {
+    'numThreads': None,
+    'cachePriming.numThreads': 'physical',
+    'lru.capacity': None,
+    'cachePriming.enable': True,
+}
+"""The settings that the `auto` profile tunes, with their defaults. Settings changed by the user are left alone."""
+
+SCAN_TIME_BUDGET = 0.5
+"""Seconds to spend at most on counting the `.rs` files of a workspace."""
+
+SKIPPED_DIRECTORIES = {'target', 'node_modules'}
+
+_PACKAGE_PATTERN = re.compile(r'^\[\[package\]\]\s*$', re.MULTILINE)
+
+
+class Machine(NamedTuple):
+    cores: int
+    available_memory: Optional[int]
+    """In bytes, if known."""
+
+
+class WorkspaceSize(NamedTuple):
+    crates: int
+    """The packages in `Cargo.lock`, including dependencies."""
+    rust_files: int
+    """The `.rs` files of the workspace itself, a lower bound if counting took too long."""
+
+
+def physical_core_count() -> int:
+    """The number of physical CPU cores, falling back to the number of logical ones where it is unknown."""
+    try:
+        with open('/proc/cpuinfo', encoding='utf-8') as f:
+            cores: set[Tuple[str, str]] = set()
+            physical_id = ''
+            for line in f:
+                key, _, value = line.partition(':')
+                key, value = key.strip(), value.strip()
+                if key == 'physical id':
+                    physical_id = value
+                elif key == 'core id':
+                    cores.add((physical_id, value))
+            if cores:
+                return len(cores)
+    except OSError:
+        pass
+    return os.cpu_count() or 1
+
+
+def available_memory() -> int | None:
+    """The memory available to new processes in bytes, or the physical memory where that is unknown."""
+    try:
+        with open('/proc/meminfo', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if sublime.platform() == 'windows':
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [
+                ('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                ('ullAvailExtendedVirtual', ctypes.c_ulonglong),
+            ]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):  # type: ignore
+            return status.ullAvailPhys
+        return None
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def workspace_size(root: str) -> WorkspaceSize:
+    crates = 0
+    try:
+        crates = len(_PACKAGE_PATTERN.findall((Path(root) / 'Cargo.lock').read_text(encoding='utf-8')))
+    except (OSError, UnicodeDecodeError):
+        pass
+    rust_files = 0
+    deadline = time.monotonic() + SCAN_TIME_BUDGET
+    for _, directories, files in os.walk(root):
+        directories[:] = [d for d in directories if not d.startswith('.') and d not in SKIPPED_DIRECTORIES]
+        rust_files += sum(1 for file in files if file.endswith('.rs'))
+        if time.monotonic() > deadline:
+            break
+    return WorkspaceSize(crates, rust_files)
+
+
+def tune(machine: Machine, workspace: WorkspaceSize) -> dict[str, Any]:
+    """Choose the thread counts and cache sizes of the server for a machine and a workspace."""
+    memory_gib = machine.available_memory / GIB if machine.available_memory is not None else 8
+    large = workspace.crates >= 300 or workspace.rust_files >= 5000
+    small = workspace.crates < 50 and workspace.rust_files < 500
+    # Each cache priming thread holds the item trees of the crate it indexes, roughly up to a GiB in large
+    # workspaces, and more workers than cores only contend.
+    priming_threads = max(1, min(machine.cores, int(memory_gib / (1 if large else 0.5))))
+    if small:
+        priming_threads = min(priming_threads, 4)
+    if large and memory_gib >= 16:
+        lru_capacity = 512
+    elif large and memory_gib >= 8:
+        lru_capacity = 256
+    elif memory_gib < 4:
+        lru_capacity = 64
+    else:
+        lru_capacity = 128
+    return {
+        # Requests rarely fan out to more than a handful of workers.
+        'numThreads': max(2, min(machine.cores, 4 if small else 16)),
+        'cachePriming.numThreads': priming_threads,
+        'lru.capacity': lru_capacity,
+        # Priming a large workspace without spare memory is likely to push the machine into swap.
+        'cachePriming.enable': not (large and memory_gib < 2),
+    }
+
+
+def describe(machine: Machine, workspace: WorkspaceSize) -> str:
+    memory = f'{machine.available_memory / GIB:.1f} GiB' if machine.available_memory is not None else 'unknown'
+    return (f'{machine.cores} physical cores, {memory} of available memory, {workspace.crates} crates in '
+            f'Cargo.lock and {workspace.rust_files} .rs files')
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+from functools import partial
+from LSP.plugin import LspWindowCommand
+from typing import Any
+import sublime
+import sublime_plugin
+import time
+
+CONFIG_NAME = 'rust-analyzer'
+
+IDLE_CHECK_INTERVAL_MS = 60_000
+
+_last_activity: dict[int, float] = {}
+"""The last time each window was focused or edited, by window id."""
+
+_hibernated: dict[int, frozenset[str]] = {}
+"""The folders of the windows whose server was stopped for being idle, by window id."""
+
+_waking: list[frozenset[str]] = []
+"""The folders of hibernated windows whose server is about to be started again."""
+
+_check_generation = 0
+
+
+def window_setting(window: sublime.Window, key: str) -> Any:
+    """A root setting of this package, which projects can override in their `"LSP"` settings."""
+    project_settings = (window.project_data() or {}).get('settings', {})
+    overrides = project_settings.get('LSP', {}).get(CONFIG_NAME, {})
+    if key in overrides:
+        return overrides[key]
+    return sublime.load_settings('LSP-rust-analyzer.sublime-settings').get(key)
+
+
+def record_activity(window: sublime.Window | None) -> None:
+    if window is not None:
+        _last_activity[window.id()] = time.monotonic()
+
+
+def hibernate_idle_windows() -> None:
+    now = time.monotonic()
+    active_window = sublime.active_window()
+    for window in sublime.windows():
+        if window == active_window:
+            record_activity(window)
+            continue
+        minutes = window_setting(window, 'idle_hibernation_minutes')
+        last_activity = _last_activity.setdefault(window.id(), now)
+        if minutes and window.id() not in _hibernated and now - last_activity >= minutes * 60:
+            window.run_command('rust_analyzer_hibernate')
+
+
+def schedule_idle_check(generation: int) -> None:
+    if generation != _check_generation:
+        return
+    hibernate_idle_windows()
+    sublime.set_timeout_async(partial(schedule_idle_check, generation), IDLE_CHECK_INTERVAL_MS)
+
+
+def wake(window: sublime.Window) -> None:
+    if window.id() in _hibernated:
+        window.run_command('rust_analyzer_wake')
+
+
+def is_waking(folders: list[str]) -> bool:
+    """Whether a server for `folders` is started because its window was activated again after hibernation."""
+    key = frozenset(folders)
+    if key in _waking:
+        _waking.remove(key)
+        return True
+    return False
+
+
+class RustAnalyzerHibernateCommand(LspWindowCommand):
+    """Stop the server of the window until a Rust view of the window is activated again."""
+
+    def is_enabled(self) -> bool:
+        return self.session_by_name(self.session_name) is not None
+
+    def run(self) -> None:
+        session = self.session_by_name(self.session_name)
+        if session is None:
+            return
+        _hibernated[self.window.id()] = frozenset(self.window.folders())
+        print(f'LSP-rust-analyzer: stopping the server of idle window {self.window.id()} until it is used again')
+        sublime.set_timeout_async(session.end_async)
+
+
+class RustAnalyzerWakeCommand(LspWindowCommand):
+    """Start the server of a hibernated window again, unless LSP already started one for the activated view."""
+
+    def is_enabled(self) -> bool:
+        return True
+
+    def run(self) -> None:
+        folders = _hibernated.pop(self.window.id(), None)
+        if folders is None or self.session_by_name(self.session_name) is not None:
+            return
+        _waking.append(folders)
+        self.window.run_command('lsp_restart_server', {'config_name': CONFIG_NAME})
+
+
+class RustAnalyzerHibernationListener(sublime_plugin.EventListener):
+
+    def on_activated_async(self, view: sublime.View) -> None:
+        window = view.window()
+        record_activity(window)
+        if window is not None and window.id() in _hibernated and view.match_selector(0, 'source.rust'):
+            wake(window)
+
+    def on_modified_async(self, view: sublime.View) -> None:
+        record_activity(view.window())
+
+    def on_pre_close_window(self, window: sublime.Window) -> None:
+        _last_activity.pop(window.id(), None)
+        _hibernated.pop(window.id(), None)
+
+
+def plugin_loaded() -> None:
+    global _check_generation
+    _check_generation += 1
+    sublime.set_timeout_async(partial(schedule_idle_check, _check_generation), IDLE_CHECK_INTERVAL_MS)
+
+
+def plugin_unloaded() -> None:
+    global _check_generation
+    _check_generation += 1
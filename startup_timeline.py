@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+from typing import TypedDict
+import hashlib
+import json
+import math
+import time
+
+MAX_RUNS = 200
+"""The runs kept per workspace. Older ones are dropped when a run is added."""
+
+PERCENTILES = (50, 90, 99)
+
+
+class TimelineRecord(TypedDict):
+    workspace: str
+    started: float
+    """The wall clock time the run started at."""
+    events: list[tuple[str, float]]
+    """Event names with their seconds since the start of the run, in order."""
+
+
+class Timeline:
+    """The milestones of a server start, from `on_pre_start_async` until the server is quiescent."""
+
+    def __init__(self, workspace: str) -> None:
+        self.workspace = workspace
+        self.started = time.time()
+        self._start = time.monotonic()
+        self.events: list[tuple[str, float]] = []
+        self._seen: set[str] = set()
+        # Progress titles by token, as only `begin` reports carry a title.
+        self.progress_titles: dict[Any, str] = {}
+
+    def mark(self, event: str, at: float | None = None) -> None:
+        """Record the first occurrence of `event`, now or at the given `time.monotonic()`."""
+        if event in self._seen:
+            return
+        self._seen.add(event)
+        self.events.append((event, (time.monotonic() if at is None else at) - self._start))
+        self.events.sort(key=lambda item: item[1])
+
+    def on_progress(self, params: dict[str, Any]) -> None:
+        value = params.get('value') or {}
+        token = params.get('token')
+        if value.get('kind') == 'begin':
+            title = self.progress_titles[token] = value.get('title') or str(token)
+            self.mark(f'{title} started')
+        elif value.get('kind') == 'end' and (title := self.progress_titles.pop(token, None)):
+            self.mark(f'{title} finished')
+
+    def record(self) -> TimelineRecord:
+        return {'workspace': self.workspace, 'started': self.started, 'events': self.events}
+
+
+def timeline_file(directory: Path, workspace: str) -> Path:
+    digest = hashlib.sha1(workspace.encode('utf-8')).hexdigest()[:16]
+    return directory / f'{digest}.jsonl'
+
+
+def save_timeline(directory: Path, timeline: Timeline) -> None:
+    path = timeline_file(directory, timeline.workspace)
+    directory.mkdir(parents=True, exist_ok=True)
+    lines = path.read_text(encoding='utf-8').splitlines() if path.is_file() else []
+    lines.append(json.dumps(timeline.record()))
+    path.write_text('\n'.join(lines[-MAX_RUNS:]) + '\n', encoding='utf-8')
+
+
+def load_timelines(directory: Path, workspace: str) -> list[TimelineRecord]:
+    path = timeline_file(directory, workspace)
+    if not path.is_file():
+        return []
+    records: list[TimelineRecord] = []
+    for line in path.read_text(encoding='utf-8').splitlines():
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records
+
+
+def percentile(values: list[float], p: int) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def format_timelines(records: list[TimelineRecord]) -> str:
+    latest = records[-1]
+    started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(latest['started']))
+    lines = [f'Latest start of {latest["workspace"]}, {started}:']
+    previous = 0.0
+    for event, seconds in latest['events']:
+        lines.append(f'{seconds:>9.2f}s {f"+{seconds - previous:.2f}s":>10}  {event}')
+        previous = seconds
+    samples: dict[str, list[float]] = {}
+    for record in records:
+        for event, seconds in record['events']:
+            samples.setdefault(event, []).append(seconds)
+    lines.append('')
+    lines.append(f'Seconds since the start over {len(records)} runs:')
+    header = ''.join(f'{f"p{p}":>9}' for p in PERCENTILES)
+    lines.append(f'{header}{"runs":>6}  Event')
+    for event, values in sorted(samples.items(), key=lambda item: percentile(item[1], 50)):
+        columns = ''.join(f'{percentile(values, p):>9.2f}' for p in PERCENTILES)
+        lines.append(f'{columns}{len(values):>6}  {event}')
+    return '\n'.join(lines) + '\n'